@@ -0,0 +1,442 @@
+# %%
+### prepare
+import io
+import os
+import glob
+import time
+import random
+import shutil
+import zipfile
+import argparse
+import threading
+import pandas as pd
+from functools import partial
+from itertools import accumulate
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from normalization import TextNormalizer, regex_normalize
+from ingestion import DataIngestion
+from processing import DataProcessing
+from exploration import DataExploration
+from filtering import UposFilter
+
+# frequent words, enough for the language detection to recognise a report
+LANGUAGE_WORDS = {
+    "de": ("und der die das ist nicht wir unsere mit für auf eine einen nachhaltigkeit "
+        "unternehmen umwelt mitarbeiter bericht jahr werden haben auch sich durch"),
+    "fr": ("et le la les est pas nous notre avec pour sur une des entreprise "
+        "environnement durable rapport salariés année sont ont aussi dans par"),
+    "es": ("y el la los es no nosotros nuestra con para sobre una empresa medio "
+        "ambiente sostenibilidad informe empleados año son han también en por"),
+}
+COUNTRIES = ["Spain", "France", "Germany", "Brazil", "Japan", "United States of America"]
+SECTORS = ["Banks", "Chemicals", "Construction & Materials", "Food Producers",
+    "Industrial Engineering", "Oil & Gas Producers", "Software & Computer Services"]
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+class Benchmarks():
+
+    def __init__(self, seed = 0, n_docs = 20, doc_words = 200000,
+            work_dir = "../data/benchmarks/", languages = ("de", "fr", "es"),
+            foreign_share = 0.1, office_share = 0.1, sample_interval = 0.05) -> None:
+        self.seed = seed
+        self.n_docs = n_docs
+        self.doc_words = doc_words
+        self.work_dir = work_dir
+        self.languages = list(languages)
+        self.foreign_share = foreign_share
+        self.office_share = office_share
+        self.sample_interval = sample_interval
+        pass
+
+    def _generate_vocabulary(self, rng, n_words=5000):
+        letters = "etaoinshrdlcumwfgypbvkjxqz"
+        weights = [12.7, 9.1, 8.2, 7.5, 7.0, 6.7, 6.3, 6.1, 6.0, 4.3, 4.0, 2.8, 2.8,
+            2.4, 2.4, 2.2, 2.0, 2.0, 1.9, 1.5, 1.0, 0.8, 0.2, 0.2, 0.1, 0.1]
+        vocab = ["the", "and", "of", "to", "in", "our", "we", "for"]
+        while len(vocab) < n_words:
+            vocab.append("".join(rng.choices(letters, weights, k=rng.randint(2, 14))))
+        return vocab
+
+    def _generate_text(self, rng, vocab, n_words):
+        noise = ["<b>", "</p>", "https://www.unglobalcompact.org/cop", "2021", "\\-",
+            "CO2", "é", "\n", "\t", ".", ",", "!", "info@company.com", "•"]
+        # zipf-like word frequencies, short words dominate as in real reports
+        cum_weights = list(accumulate(1/(i+1) for i in range(len(vocab))))
+        words = rng.choices(vocab, cum_weights=cum_weights, k=n_words)
+        for i in range(n_words):
+            r = rng.random()
+            if r < 0.05:
+                words[i] = rng.choice(noise)
+            elif r < 0.06 and i > 0:
+                # repeated tokens, e.g. page headers glued by the extractor
+                words[i] = words[i-1]
+            elif r < 0.0605:
+                # missing spaces produce very long letter runs
+                words[i] = "".join(rng.choices(vocab, k=rng.randint(20, 200)))
+            elif r < 0.15:
+                words[i] = words[i].capitalize()
+        return " ".join(words)
+
+    def generate_texts(self):
+        rng = random.Random(self.seed)
+        vocab = self._generate_vocabulary(rng)
+        return [self._generate_text(rng, vocab, rng.randint(self.doc_words//10, self.doc_words))
+            for _ in range(self.n_docs)]
+
+    def _time(self, func, texts):
+        start = time.perf_counter()
+        outputs = [func(t) for t in texts]
+        return outputs, time.perf_counter()-start
+
+    def bench_normalization(self, texts=None):
+        if texts is None:
+            texts = self.generate_texts()
+        normalizer = TextNormalizer()
+        stream = lambda t: "".join(normalizer.iter_normalize(
+            normalizer._iter_chunks(io.StringIO(t))))
+        size = sum(len(t) for t in texts)/10**6
+        reference, reference_time = self._time(regex_normalize, texts)
+        results = {"mb": size, "regex_mb_per_sec": size/reference_time}
+        for name, func in [("normalize", normalizer.normalize), ("stream", stream)]:
+            outputs, elapsed = self._time(func, texts)
+            if outputs != reference:
+                raise AssertionError(f"{name} output differs from the regex reference")
+            results[name+"_mb_per_sec"] = size/elapsed
+            results[name+"_speedup"] = reference_time/elapsed
+        return results
+
+    def _generate_foreign_text(self, rng, language, n_words):
+        words = LANGUAGE_WORDS[language].split()
+        sentences, i = [], 0
+        while i < n_words:
+            k = rng.randint(6, 20)
+            sentences.append(" ".join(rng.choices(words, k=k)).capitalize() + ".")
+            i += k
+        return " ".join(sentences)
+
+    def _generate_report(self, rng, vocab):
+        # report length spans two orders of magnitude, as the real ones do
+        n_words = int(self.doc_words*rng.uniform(0.01, 1.0))
+        if self.languages and rng.random() < self.foreign_share:
+            return self._generate_foreign_text(rng, rng.choice(self.languages), n_words)
+        return self._generate_text(rng, vocab, n_words)
+
+    def _escape_pdf(self, line):
+        line = line.encode("latin-1", "replace").decode("latin-1")
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    def _make_pdf(self, text, path, line_chars=90, page_lines=50):
+        # a minimal pdf with one text stream per page, enough for PyPDF2 to read back
+        words, lines, line = text.split(), [], ""
+        for w in words:
+            if len(line)+len(w) > line_chars:
+                lines.append(line)
+                line = ""
+            line += w + " "
+        lines.append(line)
+        pages = [lines[i:i+page_lines] for i in range(0, len(lines), page_lines)]
+        objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+        kids = []
+        for page in pages:
+            stream = "BT /F1 10 Tf 14 TL 40 800 Td " + " ".join(
+                f"({self._escape_pdf(l)}) Tj T*" for l in page) + " ET"
+            objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n"
+                f"{stream}\nendstream")
+            objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+            kids.append(f"{len(objects)} 0 R")
+        objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+        out, offsets = b"%PDF-1.4\n", []
+        for i, obj in enumerate(objects):
+            offsets.append(len(out))
+            out += f"{i+1} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+        xref = len(out)
+        out += f"xref\n0 {len(objects)+1}\n0000000000 65535 f \n".encode("latin-1")
+        out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode("latin-1")
+        out += (f"trailer\n<< /Size {len(objects)+1} /Root 1 0 R >>\n"
+            f"startxref\n{xref}\n%%EOF\n").encode("latin-1")
+        with open(path, "wb") as f:
+            f.write(out)
+        return path
+
+    def _make_docx(self, text, path):
+        # the smallest package word processors accept, the conversion stage gets real work
+        body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in
+            text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").split("\n"))
+        with zipfile.ZipFile(path, "w") as z:
+            z.writestr("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?>'
+                '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                '<Default Extension="xml" ContentType="application/xml"/>'
+                '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+                '</Types>')
+            z.writestr("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+                '</Relationships>')
+            z.writestr("word/document.xml", '<?xml version="1.0" encoding="UTF-8"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>')
+        return path
+
+    def generate_corpus(self):
+        # served files and a docs csv in the layout of the unglobalcompact export
+        rng = random.Random(self.seed)
+        vocab = self._generate_vocabulary(rng)
+        serve_dir = os.path.join(self.work_dir, "served")
+        os.makedirs(serve_dir, exist_ok=True)
+        rows = []
+        for i in range(self.n_docs):
+            text = self._generate_report(rng, vocab)
+            if rng.random() < self.office_share:
+                name = self._make_docx(text, os.path.join(serve_dir, f"cop_{i}.docx"))
+            else:
+                name = self._make_pdf(text, os.path.join(serve_dir, f"cop_{i}.pdf"))
+            rows.append({"Name": f"Company {i}", "Type": rng.choice(["Company", "SME"]),
+                "Country": rng.choice(COUNTRIES), "Sector": rng.choice(SECTORS),
+                "Communication On Progress File": "{base_url}/" + os.path.basename(name)})
+        self.docs_template = pd.DataFrame(rows)
+        return self
+
+    def serve(self):
+        # a local stand-in for the report host, the download stage runs offline
+        handler = partial(_QuietHandler, directory=os.path.join(self.work_dir, "served"))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        docs = self.docs_template.copy()
+        docs["Communication On Progress File"] = docs["Communication On Progress File"]\
+            .str.replace("{base_url}", base_url, regex=False)
+        self.docs_file = os.path.join(self.work_dir, "docs.csv")
+        docs.to_csv(self.docs_file, index=False)
+        return self
+
+    def _get_rss(self, pid):
+        # resident memory of a process and of all its children, worker pools included
+        try:
+            with open(f"/proc/{pid}/statm", "r") as f:
+                rss = int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            return 0
+        for path in glob.glob(f"/proc/{pid}/task/*/children"):
+            try:
+                with open(path, "r") as f:
+                    children = f.read().split()
+            except OSError:
+                continue
+            rss += sum(self._get_rss(int(c)) for c in children)
+        return rss
+
+    def _sample_rss(self, stop, peak):
+        while not stop.wait(self.sample_interval):
+            peak[0] = max(peak[0], self._get_rss(os.getpid()))
+
+    def _measure(self, name, func, inputs=None, count=None, size=None):
+        # count maps the stage output to the number of items it produced successfully
+        rss_start = self._get_rss(os.getpid())
+        peak, stop = [rss_start], threading.Event()
+        sampler = threading.Thread(target=self._sample_rss, args=(stop, peak), daemon=True)
+        sampler.start()
+        start, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            output = func()
+        finally:
+            stop.set()
+            sampler.join()
+        wall = time.perf_counter()-start
+        peak_rss = max(peak[0], self._get_rss(os.getpid()))
+        items = None if count is None else int(count(output))
+        if inputs and not items:
+            raise AssertionError(f"Stage '{name}' produced no output from {inputs} inputs.")
+        # memory is sampled during the stage only, earlier stages do not leak into it
+        result = {"stage": name, "wall": wall, "cpu": time.process_time()-start_cpu,
+            "rss_start_mb": rss_start/2**20, "peak_rss_mb": peak_rss/2**20,
+            "rss_delta_mb": (peak_rss-rss_start)/2**20, "inputs": inputs,
+            "items": items, "mb": size}
+        result["items_per_sec"] = items/wall if items and wall>0 else None
+        result["mb_per_sec"] = size/wall if size and wall>0 else None
+        print(f"Benchmarked '{name}' in {wall:.2f}s.")
+        return result
+
+    def _get_size(self, paths):
+        return sum(os.path.getsize(p) for p in paths if isinstance(p, str)
+            and os.path.exists(p))/10**6
+
+    def bench_ingestion(self, download_kwargs=None, convert_kwargs=None, read_kwargs=None,
+            n_jobs=4):
+        folder = os.path.join(self.work_dir, "ingestion/")
+        raw_folder = os.path.join(folder, "raw_files/")
+        txt_folder = os.path.join(folder, "txt_files/")
+        corpus_dir = os.path.join(folder, "corpus/")
+        # every run starts from empty folders, nothing is skipped as already done
+        for d in [raw_folder, txt_folder, corpus_dir]:
+            shutil.rmtree(d, ignore_errors=True)
+        os.makedirs(raw_folder, exist_ok=True)
+        ingestion = DataIngestion(self.docs_file, raw_folder, folder)
+        results = [self._measure("ingestion.load_data", ingestion.load_data)]
+        results.append(self._measure("ingestion.download_reports",
+            lambda: ingestion.download_reports(**(download_kwargs
+                or {"engine": "async", "max_per_host": 16})), self.n_docs,
+            lambda _: ingestion.docs_data.file_destination.map(os.path.exists).sum(),
+            self._get_size(self.docs_template.index.map(lambda i:
+                os.path.join(self.work_dir, "served", os.path.basename(
+                    self.docs_template.loc[i, "Communication On Progress File"]))))))
+        office_rows = ingestion.docs_data.file_destination.str.endswith(".docx")
+        results.append(self._measure("ingestion.convert_reports",
+            lambda: ingestion.convert_reports(**(convert_kwargs
+                or {"engine": "pool"})), int(office_rows.sum()),
+            lambda _: ingestion.docs_data.loc[office_rows,
+                "converted_file_destination"].notnull().sum()))
+        results.append(self._measure("ingestion.read_reports",
+            lambda: ingestion.read_reports(n_jobs=n_jobs, corpus_dir=corpus_dir,
+                txt_folder=txt_folder, **(read_kwargs or {"engine": "stream"})),
+            int(ingestion.docs_data.converted_file_destination.notnull().sum()),
+            lambda _: ingestion.docs_data.corpus_destination.notnull().sum(),
+            self._get_size(ingestion.docs_data.converted_file_destination)))
+        self.ingested_file = os.path.join(folder, "ingested.parquet")
+        ingestion.save_data(self.ingested_file)
+        return results
+
+    def bench_processing(self, upos_kwargs=None, n_jobs=4):
+        folder = os.path.join(self.work_dir, "processing/")
+        for d in ["text_shards/", "upos_files/"]:
+            shutil.rmtree(os.path.join(folder, d), ignore_errors=True)
+            os.makedirs(os.path.join(folder, d), exist_ok=True)
+        processing = DataProcessing(self.ingested_file, folder)
+        processing.load_data()
+        results = [self._measure("processing.preprocess_reports",
+            lambda: processing.preprocess_reports(n_jobs, stream=True,
+                dir_name=os.path.join(folder, "text_shards/")), len(processing.data),
+            lambda _: (processing.data.text_chars>0).sum())]
+        size = processing.data.text_chars.sum()/10**6
+        results.append(self._measure("processing.construct_upos",
+            lambda: processing.construct_upos(n_jobs, os.path.join(folder, "upos_files/"),
+                **(upos_kwargs or {"engine": "arrow", "stream_filter": True})),
+            int((processing.data.text_chars>0).sum()), lambda _: len(processing.data), size))
+        results.append(self._measure("processing.get_metadata",
+            lambda: processing.get_metadata(n_jobs=n_jobs, engine="batched"),
+                len(processing.data), lambda _: len(processing.data)))
+        self.processed_file = os.path.join(folder, "processed.parquet")
+        processing.save_data(self.processed_file)
+        return results
+
+    def bench_exploration(self, n_topics=10):
+        exploration = DataExploration(self.processed_file)
+        exploration.data = pd.read_parquet(self.processed_file)
+        n_docs = len(exploration.data)
+        if n_docs == 0:
+            raise AssertionError(f"No processed reports in '{self.processed_file}' to explore.")
+        return [self._measure("exploration.construct_ngram_stats",
+                lambda: exploration.construct_ngram_stats(range=(1,3),
+                    max_features={1: 5000, 2: 3000, 3: 2000}), n_docs,
+                lambda _: n_docs if len(exploration.ngram_stats) else 0),
+            self._measure("exploration.construct_cooc_stats",
+                exploration.construct_cooc_stats, n_docs,
+                lambda _: n_docs if len(exploration.cooc_stats) else 0),
+            self._measure("exploration.construct_lda",
+                lambda: exploration.construct_lda(n_topics=n_topics), n_docs,
+                lambda _: exploration.tf_data.shape[0])]
+
+    def _generate_upos(self, path, n_shards=4):
+        # tagged tokens in the arrow tagger layout, without the tagger itself
+        rng = random.Random(self.seed)
+        vocab = self._generate_vocabulary(rng)
+        frames = []
+        for i, text in enumerate(self.generate_texts()):
+            words = text.lower().split()
+            frames.append(pd.DataFrame({"doc_id": i, "text": words, "lemma": words,
+                "pos": rng.choices(["NOUN", "ADJ", "VERB", "DET", "ADP"], k=len(words)),
+                "is_stopword": [w in vocab[:8] for w in words]}))
+        upos = pd.concat(frames, ignore_index=True)
+        os.makedirs(path, exist_ok=True)
+        ids = list(range(self.n_docs))
+        for k in range(n_shards):
+            part = upos.loc[upos.doc_id.isin(ids[k::n_shards]),]
+            part.to_parquet(os.path.join(path, f"{k}.parquet"))
+        return upos
+
+    def bench_filtering(self, min_count=100, min_docs=5):
+        path = os.path.join(self.work_dir, "filtering/")
+        upos = self._generate_upos(path)
+        processing = DataProcessing()
+        upos_filter = UposFilter(min_count=min_count, min_docs=min_docs)
+        sources = upos_filter.get_sources(path, list(range(self.n_docs)))
+        return [self._measure("filtering.memory", lambda: processing._reconstruct_upos(
+                processing._filter_upos(upos, min_count, min_docs)), self.n_docs, len),
+            self._measure("filtering.stream", lambda: upos_filter.run(sources),
+                self.n_docs, len)]
+
+    def run(self, stages=("normalization", "ingestion", "processing", "exploration"),
+            upos_kwargs=None, n_jobs=4):
+        results = []
+        if "normalization" in stages:
+            normalization = self.bench_normalization()
+            results.append({"stage": "normalization", "mb": normalization["mb"],
+                "mb_per_sec": normalization["stream_mb_per_sec"]})
+        if "ingestion" in stages:
+            self.generate_corpus().serve()
+            try:
+                results += self.bench_ingestion(n_jobs=n_jobs)
+            finally:
+                self.server.shutdown()
+        if "processing" in stages:
+            results += self.bench_processing(upos_kwargs, n_jobs)
+        if "exploration" in stages:
+            results += self.bench_exploration()
+        if "filtering" in stages:
+            results += self.bench_filtering()
+        self.results = pd.DataFrame(results).set_index("stage")
+        return self.results
+
+    def save_baseline(self, path):
+        self.results.to_json(path, orient="index", indent=1)
+        return self
+
+    def compare(self, path, tolerance=0.25, memory_slack_mb=32):
+        # throughput may not drop and the memory a stage adds may not grow by more
+        # than the tolerance, the slack keeps small stages clear of sampling noise
+        baseline = pd.read_json(path, orient="index")
+        regressions = []
+        for stage in self.results.index.intersection(baseline.index):
+            for metric in ["items_per_sec", "mb_per_sec"]:
+                old, new = baseline.loc[stage].get(metric), self.results.loc[stage].get(metric)
+                if pd.notnull(old) and pd.notnull(new) and new < old*(1-tolerance):
+                    regressions.append(f"{stage} {metric}: {new:.3g} < {old:.3g}")
+            old, new = baseline.loc[stage].get("rss_delta_mb"), self.results.loc[stage].get("rss_delta_mb")
+            if pd.notnull(old) and pd.notnull(new) and new > old*(1+tolerance)+memory_slack_mb:
+                regressions.append(f"{stage} rss_delta_mb: {new:.0f} > {old:.0f}")
+        if regressions:
+            raise AssertionError("Benchmark regressions:\n" + "\n".join(regressions))
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic corpus.")
+    parser.add_argument("--n-docs", type=int, default=1000)
+    parser.add_argument("--doc-words", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-jobs", type=int, default=4)
+    parser.add_argument("--stages", default="normalization,ingestion,processing,exploration")
+    parser.add_argument("--work-dir", default="../data/benchmarks/")
+    parser.add_argument("--upos-model", default="en_core_web_lg")
+    parser.add_argument("--baseline", default=None, help="json baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+    benchmarks = Benchmarks(args.seed, args.n_docs, args.doc_words, args.work_dir)
+    results = benchmarks.run(args.stages.split(","), {"engine": "arrow",
+        "model": args.upos_model, "stream_filter": True}, args.n_jobs)
+    print(results.to_string())
+    if args.baseline is not None:
+        if args.update_baseline or not os.path.exists(args.baseline):
+            benchmarks.save_baseline(args.baseline)
+        else:
+            benchmarks.compare(args.baseline, args.tolerance)
+
+# %%
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# %%
+### prepare
+import os
+import time
+import queue
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+
+class ConversionPool():
+
+    def __init__(self,
+                n_workers = 4,
+                converter = "libreoffice",
+                batch_size = 8,
+                timeout = 120,
+                profile_dir = None,
+                poll_interval = 0.1) -> None:
+        self.n_workers = n_workers
+        self.converter = converter
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.profile_dir = profile_dir
+        self.poll_interval = poll_interval
+        pass
+
+    def _get_conversion_path(self, file_path, dir_name):
+        name, extension = os.path.splitext(os.path.basename(file_path))
+        return os.path.join(dir_name, name+".pdf")
+
+    def _get_batches(self, jobs):
+        # batches never mix output directories, one invocation writes to one outdir
+        by_dir = {}
+        for file_path, dir_name in jobs:
+            by_dir.setdefault(dir_name, []).append(file_path)
+        for dir_name, files in by_dir.items():
+            for i in range(0, len(files), self.batch_size):
+                yield dir_name, files[i:i+self.batch_size]
+
+    def _get_command(self, profile, dir_name, files):
+        # isolated profile per worker, concurrent instances would lock a shared one
+        return [self.converter, "-env:UserInstallation=file://" + os.path.abspath(profile),
+            "--headless", "--convert-to", "pdf", "--outdir", dir_name, *files]
+
+    def _get_converted_time(self, file_path, dir_name, start):
+        converted = self._get_conversion_path(file_path, dir_name)
+        if os.path.exists(converted) and os.path.getmtime(converted)>=start-1:
+            return os.path.getmtime(converted)
+        return None
+
+    def _wait(self, process, dir_name, files, start):
+        # soffice converts its arguments one after another, every file gets the time since
+        # the previous output appeared and the timeout applies to each file on its own
+        times, last = {}, start
+        while True:
+            try:
+                process.wait(timeout=self.poll_interval)
+                finished = True
+            except subprocess.TimeoutExpired:
+                finished = False
+            found = [(self._get_converted_time(f, dir_name, start), f)
+                for f in files if f not in times]
+            for mtime, file_path in sorted(r for r in found if r[0] is not None):
+                times[file_path] = max(mtime, last)-last
+                last = max(mtime, last)
+            if finished:
+                return times, False
+            if time.time()-last > self.timeout:
+                # kill the whole process group, soffice forks its own children
+                os.killpg(process.pid, signal.SIGKILL)
+                process.wait()
+                return times, True
+
+    def _run(self, profile, dir_name, files):
+        start = time.time()
+        with tempfile.TemporaryFile() as log:
+            process = subprocess.Popen(self._get_command(profile, dir_name, files),
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            times, timed_out = self._wait(process, dir_name, files, start)
+            log.seek(0)
+            output = log.read()
+        results = []
+        for file_path in files:
+            is_converted = file_path in times
+            status = "converted" if is_converted else ("timeout" if timed_out else "failed")
+            results.append({"file_destination": file_path,
+                "converted_file_destination": self._get_conversion_path(file_path, dir_name)
+                    if is_converted else None,
+                "conversion_status": status, "conversion_time": times.get(file_path),
+                "conversion_log": output.decode(errors="replace")[-500:]})
+        return results
+
+    def _convert_batch(self, profile, dir_name, files):
+        results = self._run(profile, dir_name, files)
+        if len(files)>1 and any(r["conversion_status"]=="timeout" for r in results):
+            # the batch was killed at a hung document, the unfinished ones are retried alone
+            retry = [r["file_destination"] for r in results if r["conversion_status"]=="timeout"]
+            results = [r for r in results if r["conversion_status"]!="timeout"]
+            for file_path in retry:
+                results += self._run(profile, dir_name, [file_path])
+        return results
+
+    def _worker(self, profile, tasks, results):
+        while True:
+            try:
+                dir_name, files = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                batch_results = self._convert_batch(profile, dir_name, files)
+            except Exception as e:
+                batch_results = [{"file_destination": f, "converted_file_destination": None,
+                    "conversion_status": "failed", "conversion_time": None,
+                    "conversion_log": str(e)} for f in files]
+            for r in batch_results:
+                if r["conversion_status"]=="converted":
+                    print(f"File on '{r['converted_file_destination']}' converted successfully.")
+                else:
+                    print(f"Error converting '{r['file_destination']}': {r['conversion_status']}.")
+            results.extend(batch_results)
+
+    def convert(self, file_list, dir_list):
+        tasks = queue.Queue()
+        for batch in self._get_batches(zip(file_list, dir_list)):
+            tasks.put(batch)
+        profile_root = self.profile_dir or tempfile.mkdtemp(prefix="conversion_profiles_")
+        results = []
+        workers = [threading.Thread(target=self._worker,
+            args=(os.path.join(profile_root, str(i)), tasks, results))
+                for i in range(self.n_workers)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        if self.profile_dir is None:
+            shutil.rmtree(profile_root, ignore_errors=True)
+        return results
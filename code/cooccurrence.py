@@ -0,0 +1,112 @@
+# %%
+### prepare
+from itertools import compress
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+class CoocBuilder():
+
+    def __init__(self,
+                max_features = 10000,
+                top_k = 1000,
+                per_node = None,
+                window = None,
+                cache = None) -> None:
+        self.max_features = max_features
+        self.top_k = top_k
+        self.per_node = per_node
+        self.window = window
+        self.cache = cache
+        pass
+
+    def fit(self, texts):
+        if self.cache is not None:
+            self.weights, self.tokens = self.cache.get_tfidf(texts, (1,1), self.max_features)
+            self.analyzer = self.cache.get_analyzer()
+        else:
+            vectorizer = TfidfVectorizer(ngram_range=(1,1), max_features=self.max_features)
+            self.weights = vectorizer.fit_transform(texts)
+            self.tokens = vectorizer.get_feature_names_out()
+            self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary = {t: i for i, t in enumerate(self.tokens)}
+        return self
+
+    def _doc_cooc(self, rows):
+        # tf-idf weighted document co-occurrence, the product stays sparse
+        w = self.weights[rows]
+        cooc = sp.triu(w.T.dot(w), k=1).tocoo()
+        cooc.eliminate_zeros()
+        return cooc
+
+    def _pairs_to_matrix(self, ind0, ind1):
+        n = len(self.tokens)
+        ind0 = np.concatenate(ind0) if ind0 else np.zeros(0, dtype=np.int64)
+        ind1 = np.concatenate(ind1) if ind1 else np.zeros(0, dtype=np.int64)
+        return sp.coo_matrix((np.ones(len(ind0)), (ind0, ind1)), shape=(n, n)).tocsr()
+
+    def _window_cooc(self, texts, batch_size=100):
+        # token pairs at most window positions apart, summed batch by batch so the
+        # pair arrays never outgrow a handful of documents
+        analyzer, vocabulary = self.analyzer, self.vocabulary
+        cooc, ind0, ind1 = self._pairs_to_matrix([], []), [], []
+        for i, text in enumerate(texts):
+            ids = np.fromiter((vocabulary.get(t, -1) for t in analyzer(text)), dtype=np.int64)
+            for d in range(1, self.window+1):
+                a, b = ids[:-d], ids[d:]
+                keep = (a>=0) & (b>=0) & (a!=b)
+                ind0.append(np.minimum(a[keep], b[keep]))
+                ind1.append(np.maximum(a[keep], b[keep]))
+            if (i+1) % batch_size == 0:
+                cooc, ind0, ind1 = cooc + self._pairs_to_matrix(ind0, ind1), [], []
+        return (cooc + self._pairs_to_matrix(ind0, ind1)).tocoo()
+
+    def _scale(self, cooc):
+        # min-max over all token pairs, pairs that never co-occur count as zeros
+        n = cooc.shape[0]
+        low = cooc.data.min() if cooc.nnz == n*(n-1)//2 and cooc.nnz else 0.0
+        high = cooc.data.max() if cooc.nnz else 0.0
+        if high == low:
+            return np.zeros(cooc.nnz)
+        return (cooc.data-low)/(high-low)
+
+    def _top_global(self, cooc):
+        k = min(self.top_k, cooc.nnz)
+        return np.argpartition(-cooc.data, k-1)[:k] if k else np.zeros(0, dtype=np.int64)
+
+    def _top_per_node(self, cooc):
+        # each node keeps its per_node heaviest edges, looked at from both ends
+        nodes = np.concatenate([cooc.row, cooc.col])
+        edges = np.concatenate([np.arange(cooc.nnz)]*2)
+        order = np.lexsort((-np.concatenate([cooc.data]*2), nodes))
+        nodes, edges = nodes[order], edges[order]
+        starts = np.searchsorted(nodes, nodes, side="left")
+        rank = np.arange(len(nodes))-starts
+        return np.unique(edges[rank<self.per_node])
+
+    def _select(self, cooc):
+        weight = self._scale(cooc)
+        keep = self._top_per_node(cooc) if self.per_node else self._top_global(cooc)
+        keep = keep[np.argsort(-weight[keep], kind="stable")]
+        return pd.DataFrame({"from": cooc.row[keep].astype(np.int32),
+            "to": cooc.col[keep].astype(np.int32), "weight": weight[keep]})
+
+    def build(self, texts, groups=None):
+        self.fit(texts)
+        if groups is None:
+            subsets = [(None, np.arange(len(texts)))]
+        else:
+            subsets = list(pd.Series(list(groups)).groupby(list(groups)).groups.items())
+        edges = []
+        for code, (group, rows) in enumerate(subsets):
+            if self.window is None:
+                cooc = self._doc_cooc(np.asarray(rows))
+            else:
+                cooc = self._window_cooc(compress(texts, np.isin(np.arange(len(texts)), rows)))
+            selected = self._select(cooc)
+            if groups is not None:
+                selected.insert(0, "group", np.int32(code))
+            edges.append(selected)
+        self.groups = np.array([g for g, _ in subsets], dtype=object)
+        return pd.concat(edges, ignore_index=True)
@@ -0,0 +1,165 @@
+# %%
+### prepare
+import os
+import mmap
+import fcntl
+import numpy as np
+import pandas as pd
+
+# stores opened by a worker process are reused across its tasks
+_STORES = {}
+
+def get_store(dir_name):
+    if dir_name not in _STORES:
+        _STORES[dir_name] = CorpusStore(dir_name)
+    return _STORES[dir_name]
+
+class CorpusStore():
+
+    def __init__(self, dir_name = "../data/corpus/") -> None:
+        self.dir_name = dir_name
+        self.data_path = os.path.join(dir_name, "texts.bin")
+        self.index_path = os.path.join(dir_name, "index.bin")
+        self.sources_path = os.path.join(dir_name, "sources.bin")
+        self.index = None
+        self.sources = None
+        self.buffer = None
+        self.stamp = None
+        pass
+
+    def get_stamp(self, path):
+        # a source counts as unchanged while its mtime and size are
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _append(self, records):
+        # one lock per call, index records are written only after their text and the
+        # source stamps after the index, a torn write leaves a document out of date
+        os.makedirs(self.dir_name, exist_ok=True)
+        with open(self.data_path, "ab") as data, open(self.index_path, "ab") as index,\
+                open(self.sources_path, "ab") as sources:
+            fcntl.flock(data, fcntl.LOCK_EX)
+            try:
+                offset = data.seek(0, os.SEEK_END)
+                rows, stamps = [], []
+                for doc_id, encoded, stamp in records:
+                    data.write(encoded)
+                    rows.append((doc_id, offset, len(encoded)))
+                    stamps.append((doc_id,) + (stamp or (-1, -1)))
+                    offset += len(encoded)
+                data.flush()
+                index.write(np.array(rows, dtype=np.int64).reshape(-1, 3).tobytes())
+                index.flush()
+                sources.write(np.array(stamps, dtype=np.int64).reshape(-1, 3).tobytes())
+                sources.flush()
+            finally:
+                fcntl.flock(data, fcntl.LOCK_UN)
+        self.index, self.sources, self.buffer = None, None, None
+        return self
+
+    def append(self, doc_id, text, stamp=None):
+        return self._append([(doc_id, text.encode("utf-8"), stamp)])
+
+    def extend(self, ids, texts, batch_size=100):
+        batch = []
+        for doc_id, text in zip(ids, texts):
+            batch.append((doc_id, text.encode("utf-8"), None))
+            if len(batch) == batch_size:
+                self._append(batch)
+                batch = []
+        if batch:
+            self._append(batch)
+        return self
+
+    def update(self, ids, texts, batch_size=100):
+        # the store only grows by documents whose text differs from the stored one
+        index = self._load_index()
+        changed = [(doc_id, text) for doc_id, text in zip(ids, texts)
+            if doc_id not in index.index or self.get_bytes(doc_id) != text.encode("utf-8")]
+        if not changed:
+            return self
+        return self.extend(*zip(*changed), batch_size=batch_size)
+
+    def append_file(self, doc_id, file_path):
+        stamp = self.get_stamp(file_path)
+        with open(file_path, "rb") as file:
+            return self._append([(doc_id, file.read(), stamp)])
+
+    def _get_index_stamp(self):
+        try:
+            return self.get_stamp(self.index_path)
+        except FileNotFoundError:
+            return None
+
+    def _read_records(self, path, columns):
+        records = np.fromfile(path, dtype=np.int64).reshape(-1, 3)\
+            if os.path.exists(path) else np.zeros((0, 3), dtype=np.int64)
+        return pd.DataFrame(records, columns=columns)\
+            .drop_duplicates("doc_id", keep="last").set_index("doc_id")
+
+    def _load_index(self):
+        # append-only, the last record of a document wins, a store cached by a worker is
+        # reopened once this or another process appended to it
+        stamp = self._get_index_stamp()
+        if self.index is None or stamp != self.stamp:
+            self.index = self._read_records(self.index_path, ["doc_id", "offset", "length"])
+            self.sources, self.buffer, self.stamp = None, None, stamp
+        return self.index
+
+    def _load_sources(self):
+        self._load_index()
+        if self.sources is None:
+            self.sources = self._read_records(self.sources_path,
+                ["doc_id", "mtime", "size"])
+        return self.sources
+
+    def is_current(self, doc_id, source_path):
+        # packed from this very source, documents without a stamp are always repacked
+        sources = self._load_sources()
+        if doc_id not in sources.index or doc_id not in self._load_index().index:
+            return False
+        try:
+            return tuple(sources.loc[doc_id]) == self.get_stamp(source_path)
+        except FileNotFoundError:
+            return False
+
+    def _load_buffer(self):
+        if self.buffer is None:
+            with open(self.data_path, "rb") as data:
+                self.buffer = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.buffer
+
+    def ids(self):
+        return self._load_index().index
+
+    def get_bytes(self, doc_id):
+        # a view into the mapped file, nothing is copied until it is decoded
+        offset, length = self._load_index().loc[doc_id]
+        return memoryview(self._load_buffer())[offset:offset+length]
+
+    def get(self, doc_id):
+        return str(self.get_bytes(doc_id), "utf-8")
+
+    def iter_texts(self, ids=None):
+        index = self._load_index()
+        if ids is not None:
+            index = index.loc[index.index.isin(ids)]
+        # in file order, the mapping is read front to back
+        for doc_id, (offset, length) in index.sort_values("offset").iterrows():
+            yield doc_id, str(self._load_buffer()[offset:offset+length], "utf-8")
+
+class CorpusTexts():
+
+    def __init__(self, store, ids, name = None) -> None:
+        self.store = store
+        self.index = pd.Index(ids)
+        self.name = name
+        pass
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        # texts in index order, one document decoded at a time
+        for doc_id in self.index:
+            yield self.store.get(doc_id)
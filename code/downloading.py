@@ -0,0 +1,148 @@
+# %%
+### prepare
+import os
+import json
+import time
+import asyncio
+import threading
+import aiohttp
+
+class AsyncDownloader():
+
+    def __init__(self,
+                max_connections = 32,
+                max_per_host = 4,
+                retries = 3,
+                backoff = 1.0,
+                timeout = 120,
+                revalidate = False,
+                chunk_size = 2**16) -> None:
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.revalidate = revalidate
+        self.chunk_size = chunk_size
+        pass
+
+    def _get_part_path(self, file_path):
+        return file_path + ".part"
+
+    def _get_meta_path(self, file_path):
+        return file_path + ".meta"
+
+    def _read_meta(self, file_path):
+        meta_path = self._get_meta_path(file_path)
+        if not os.path.exists(meta_path):
+            return {}
+        try:
+            with open(meta_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, file_path, meta):
+        with open(self._get_meta_path(file_path), "w") as f:
+            json.dump(meta, f)
+
+    def _get_validators(self, response):
+        return {"etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")}
+
+    def _get_headers(self, file_path, part_size, meta):
+        headers = {}
+        if part_size > 0:
+            headers["Range"] = f"bytes={part_size}-"
+            # resume only if the remote file has not changed in the meantime
+            validator = meta.get("etag") or meta.get("last_modified")
+            if validator is not None:
+                headers["If-Range"] = validator
+        elif os.path.exists(file_path):
+            if meta.get("etag") is not None:
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified") is not None:
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    async def _fetch_once(self, session, url, file_path):
+        part_path = self._get_part_path(file_path)
+        meta = self._read_meta(file_path)
+        part_size = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = self._get_headers(file_path, part_size, meta)
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304:
+                return {"status": "not_modified", "http_status": 304, "bytes": 0}
+            if response.status == 416:
+                # stale or oversized partial file, start over on the next attempt
+                os.remove(part_path)
+                raise aiohttp.ClientResponseError(response.request_info,
+                    response.history, status=416, message="Range not satisfiable")
+            response.raise_for_status()
+            mode = "ab" if response.status == 206 else "wb"
+            # partial metadata lets an interrupted transfer resume with If-Range
+            meta = dict(self._get_validators(response), url=url)
+            self._write_meta(file_path, meta)
+            n_bytes = 0
+            with open(part_path, mode) as file:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    file.write(chunk)
+                    n_bytes += len(chunk)
+            os.replace(part_path, file_path)
+            return {"status": "resumed" if mode == "ab" else "downloaded",
+                    "http_status": response.status, "bytes": n_bytes}
+
+    def _is_retryable(self, e):
+        if isinstance(e, aiohttp.ClientResponseError):
+            return e.status in (408, 416, 429) or e.status >= 500
+        return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+    async def _fetch(self, session, url, file_path):
+        result = {"url": url, "file_path": file_path, "status": None,
+            "http_status": None, "bytes": 0, "latency": 0.0, "attempts": 0}
+        part_exists = os.path.exists(self._get_part_path(file_path))
+        if os.path.exists(file_path) and not part_exists and not self.revalidate:
+            result["status"] = "exists"
+            return result
+        if os.path.exists(file_path) and self.revalidate and not self._read_meta(file_path):
+            # legacy download without validators, nothing to compare against
+            result["status"] = "exists"
+            return result
+        start = time.perf_counter()
+        for attempt in range(self.retries+1):
+            result["attempts"] = attempt+1
+            try:
+                result.update(await self._fetch_once(session, url, file_path))
+                break
+            except Exception as e:
+                result["status"] = "failed"
+                result["http_status"] = getattr(e, "status", None)
+                if attempt == self.retries or not self._is_retryable(e):
+                    print(f"Error downloading '{file_path}': {e}.")
+                    break
+                await asyncio.sleep(self.backoff*2**attempt)
+        result["latency"] = time.perf_counter()-start
+        return result
+
+    async def _download_all(self, url_list, path_list):
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+            limit_per_host=self.max_per_host)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout,
+            sock_read=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = [self._fetch(session, url, path)
+                for url, path in zip(url_list, path_list)]
+            return await asyncio.gather(*tasks)
+
+    def download(self, url_list, path_list):
+        coro = self._download_all(list(url_list), list(path_list))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coro)
+        # called from a running loop (e.g. jupyter), run on a separate thread
+        results = []
+        thread = threading.Thread(target=lambda: results.extend(asyncio.run(coro)))
+        thread.start()
+        thread.join()
+        return results
@@ -1,18 +1,29 @@
 # %%
+import os
+import joblib
 import numpy as np
 import pandas as pd
-from itertools import combinations
 import matplotlib.pyplot as plt
 import networkx as nx
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.feature_extraction.text import CountVectorizer
 from sklearn.decomposition import LatentDirichletAllocation
+from ngrams import NgramCounter
+from cooccurrence import CoocBuilder
+from vectorization import VectorCache
+from topics import LdaSweep
+from corpus import CorpusTexts, get_store
 
 # %%
 class DataExploration():
     
-    def __init__(self, data_path = "../data/processed.parquet"):
+    def __init__(self, data_path = "../data/processed.parquet", cache_dir = None,
+            corpus_dir = None):
         self.data_path = data_path
+        self.corpus_dir = corpus_dir
+        # one tokenization of the corpus shared by the tf, tf-idf and n-gram views
+        self.vector_cache = None
+        if cache_dir is not None:
+            self.vector_cache = VectorCache(data_path, cache_dir)
 
     def load_data(self):
         self.data = pd.read_parquet(self.data_path)
@@ -20,15 +31,21 @@ class DataExploration():
             & (self.data.language_score>=0.99),:]
         return self
     
-    def construct_ngram_stats(self, column_name="reconstructed_text", range=(1,1)):
-        cv = CountVectorizer(ngram_range=range, max_features=10000)
-        ng_counts = cv.fit_transform(self.data[column_name])
-        ng_counts = pd.DataFrame(ng_counts.todense(),
-            columns=cv.get_feature_names_out())
-        ng_counts = ng_counts.sum().reset_index()
-        ng_counts.columns = ["ngram", "frequency"]
-        ng_counts["n"] = ng_counts.ngram.apply(lambda x: len(x.split(" ")))
-        self.ngram_stats = ng_counts.loc[:,["n","ngram", "frequency"]]
+    def _get_texts(self, column_name):
+        # columns saved to packed stores are read document by document
+        if column_name in self.data.columns or self.corpus_dir is None:
+            return self.data[column_name]
+        store = get_store(os.path.join(self.corpus_dir, column_name))
+        return CorpusTexts(store, self.data.index, column_name)
+    
+    def construct_ngram_stats(self, column_name="reconstructed_text", range=(1,1),
+            max_features=10000, engine="sparse", **engine_kwargs):
+        # max_features may be a dict of per-n budgets, e.g. {1:5000, 2:3000, 3:2000}
+        counter = NgramCounter(range, max_features, cache=self.vector_cache, **engine_kwargs)
+        if engine == "hashing":
+            self.ngram_stats = counter.count_hashed(self._get_texts(column_name))
+        else:
+            self.ngram_stats = counter.count(self._get_texts(column_name))
         return self
     
     def plot_ngram_stats(self, top_n=15):
@@ -85,26 +102,25 @@ class DataExploration():
         f.tight_layout()
         return axs
     
-    def construct_cooc_stats(self, column_name="reconstructed_text"):
-        coovec = TfidfVectorizer(ngram_range=(1,1), max_features=10000)
-        coo_w = coovec.fit_transform(self.data[column_name])
-        tokens = coovec.get_feature_names_out()
-        coo_w = coo_w.T.dot(coo_w)
-        coo_w = np.triu(coo_w.todense(), k=1)
-        edges = list(combinations(range(coo_w.shape[0]),2))
-        ind0, ind1 = [e[0] for e in edges], [e[1] for e in edges]
-        freq = coo_w[ind0, ind1]
-        self.cooc_stats  = pd.DataFrame(columns=["from", "to", "weight"])
-        self.cooc_stats ["from"], self.cooc_stats ["to"] = [tokens[i]for i in ind0], [tokens[i]for i in ind1]
-        self.cooc_stats ["weight"] = freq
-        self.cooc_stats ["weight"] = MinMaxScaler()\
-            .fit_transform(self.cooc_stats [["weight"]])
+    def construct_cooc_stats(self, column_name="reconstructed_text", top_k=1000,
+            per_node=None, window=None, by=None):
+        # edges are integer coded, cooc_tokens and cooc_groups hold the lookups
+        builder = CoocBuilder(top_k=top_k, per_node=per_node, window=window,
+            cache=self.vector_cache)
+        groups = None if by is None else self.data[by]
+        self.cooc_stats = builder.build(self._get_texts(column_name), groups)
+        self.cooc_tokens, self.cooc_groups = builder.tokens, builder.groups
         return self
     
-    def plot_cooc_stats(self, figsize=(20,20)):
+    def plot_cooc_stats(self, figsize=(20,20), top_n=1000, group=None):
+        edges = self.cooc_stats
+        if group is not None:
+            edges = edges.loc[edges.group==list(self.cooc_groups).index(group),]
+        edges = edges.sort_values("weight").tail(top_n)
         net = nx.convert_matrix.from_pandas_edgelist(
-            self.cooc_stats.sort_values("weight").tail(1000),
-                source="from", target="to", edge_attr="weight")
+            pd.DataFrame({"from": self.cooc_tokens[edges["from"]],
+                "to": self.cooc_tokens[edges["to"]], "weight": edges["weight"]}),
+                    source="from", target="to", edge_attr="weight")
         f, ax = plt.subplots(1,1, figsize=figsize)
         pos = nx.kamada_kawai_layout(net)
         nx.draw_networkx_labels(net, pos, font_size=10,
@@ -115,9 +131,14 @@ class DataExploration():
         return ax
     
     def _construct_tf(self, column_name="reconstructed_text"):
+        if self.vector_cache is not None:
+            self.tf_data, self.tf_tokens = self.vector_cache.get_counts(
+                self._get_texts(column_name))
+            return self
         tfv = CountVectorizer(max_features=10000)
-        self.tf_data =  tfv.fit_transform(self.data[column_name])
+        self.tf_data =  tfv.fit_transform(self._get_texts(column_name))
         self.tf_model = tfv
+        self.tf_tokens = tfv.get_feature_names_out()
         return self
     
     def _construct_lda(self, n_topics=15):
@@ -132,14 +153,38 @@ class DataExploration():
         self._construct_lda(n_topics)
         return self
     
-    # NOTE: generalize the plotting function
-    def plot_lda_top_words(self, top_n=10, figsize=(15,10)):
-        f, axs = plt.subplots(3, 5, figsize=figsize)
+    def sweep_lda(self, column_name="reconstructed_text", n_topics=(5, 10, 15, 20, 25),
+            seeds=(0,), n_jobs=4, **sweep_kwargs):
+        # fits the grid in parallel, models are persisted and listed in lda_sweep
+        self._construct_tf(column_name)
+        sweep = LdaSweep(n_topics, seeds, n_jobs, **sweep_kwargs)
+        self.lda_model_dir = sweep.model_dir
+        self.lda_sweep = sweep.run(self.tf_data, self.tf_tokens)
+        return self
+    
+    def load_lda(self, n_topics, seed=0, model_dir=None):
+        # the grid is read back from results.csv, so models of earlier sessions load too
+        if model_dir is None:
+            model_dir = getattr(self, "lda_model_dir", "../data/lda_models/")
+        sweep = LdaSweep(model_dir=model_dir)
+        self.lda_sweep = sweep.load_results()
+        found = self.lda_sweep.loc[(self.lda_sweep.n_topics==n_topics)\
+            & (self.lda_sweep.seed==seed), "model_path"]
+        if len(found)==0:
+            raise ValueError(f"No model with {n_topics} topics and seed {seed} in '{model_dir}'.")
+        self.lda_model = joblib.load(found.iloc[0])
+        if sweep.tokens is not None:
+            self.tf_tokens = sweep.tokens
+        return self
+    
+    def plot_lda_top_words(self, top_n=10, figsize=(15,10), n_cols=5):
+        n_rows = int(np.ceil(self.lda_model.n_components/n_cols))
+        f, axs = plt.subplots(n_rows, n_cols, figsize=figsize, squeeze=False)
         axs = axs.flatten()
+        tokens = self.tf_tokens
         for topic_idx, topic in enumerate(self.lda_model.components_):
             top_features_ind = topic.argsort()[:-top_n - 1:-1]
-            top_features = [self.tf_model.get_feature_names_out()\
-                [i] for i in top_features_ind]
+            top_features = [tokens[i] for i in top_features_ind]
             weights = topic[top_features_ind]
             ax = axs[topic_idx]
             ax.barh(top_features, weights, height=0.7)
@@ -150,5 +195,7 @@ class DataExploration():
             for i in "top right left".split():
                 ax.spines[i].set_visible(False)
             f.suptitle("", fontsize=14)
+        for ax in axs[self.lda_model.n_components:]:
+            ax.set_visible(False)
         plt.subplots_adjust(top=0.90, bottom=0.05, wspace=0.90, hspace=0.3)
         return axs    
\ No newline at end of file
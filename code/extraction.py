@@ -0,0 +1,119 @@
+# %%
+### prepare
+import os
+import json
+import time
+import signal
+import threading
+from PyPDF2 import PdfReader
+from joblib import Parallel, delayed
+
+class PdfExtractor():
+
+    def __init__(self,
+                n_jobs = 7,
+                timeout = 300,
+                max_pages = 1000,
+                separator = "\n") -> None:
+        self.n_jobs = n_jobs
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.separator = separator
+        pass
+
+    def _get_cache_paths(self, txt_path):
+        return txt_path + ".part", txt_path + ".progress"
+
+    def _get_signature(self, pdf_path):
+        stat = os.stat(pdf_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime, "separator": self.separator}
+
+    def _load_progress(self, pdf_path, txt_path):
+        part_path, progress_path = self._get_cache_paths(txt_path)
+        if not (os.path.exists(part_path) and os.path.exists(progress_path)):
+            return 0, 0
+        try:
+            with open(progress_path, "r") as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return 0, 0
+        if progress.get("signature") != self._get_signature(pdf_path):
+            return 0, 0
+        return progress["pages"], progress["offset"]
+
+    def _save_progress(self, pdf_path, txt_path, pages, offset):
+        _, progress_path = self._get_cache_paths(txt_path)
+        with open(progress_path + ".tmp", "w") as f:
+            json.dump({"signature": self._get_signature(pdf_path),
+                "pages": pages, "offset": offset}, f)
+        os.replace(progress_path + ".tmp", progress_path)
+
+    def _on_timeout(self, signum, frame):
+        raise TimeoutError(f"extraction exceeded {self.timeout}s")
+
+    def _stream_pages(self, pdf_path, txt_path, result):
+        part_path, progress_path = self._get_cache_paths(txt_path)
+        start_page, offset = self._load_progress(pdf_path, txt_path)
+        reader = PdfReader(pdf_path)
+        n_pages = len(reader.pages)
+        result["n_pages"], result["start_page"] = n_pages, start_page
+        with open(part_path, "ab" if start_page else "wb") as file:
+            # drop whatever was written after the last good page
+            file.truncate(offset)
+            for i in range(start_page, min(n_pages, self.max_pages)):
+                text = reader.pages[i].extract_text() or ""
+                if i>0:
+                    text = self.separator + text
+                file.write(text.encode("utf-8"))
+                file.flush()
+                self._save_progress(pdf_path, txt_path, i+1, file.tell())
+                result["pages"] += 1
+        os.replace(part_path, txt_path)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        result["status"] = "truncated" if n_pages>self.max_pages else "extracted"
+
+    def _extract(self, pdf_path, txt_path):
+        result = {"converted_file_destination": pdf_path, "txt_file_destination": None,
+            "status": None, "n_pages": None, "start_page": 0, "pages": 0,
+            "seconds": 0.0, "pages_per_sec": None, "worker": os.getpid()}
+        start = time.perf_counter()
+        # wall clock limit, a pathological page cannot stall the worker, signals only
+        # reach the main thread, so a sequential run inside a thread goes without it
+        timed = threading.current_thread() is threading.main_thread()
+        if timed:
+            previous = signal.signal(signal.SIGALRM, self._on_timeout)
+            signal.setitimer(signal.ITIMER_REAL, self.timeout)
+        try:
+            self._stream_pages(pdf_path, txt_path, result)
+            result["txt_file_destination"] = txt_path
+            print(f"File on '{txt_path}' extracted successfully.")
+        except TimeoutError as e:
+            result["status"] = "timeout"
+            print(f"Error reading '{pdf_path}': {e}.")
+        except Exception as e:
+            result["status"] = "failed"
+            print(f"Error reading '{pdf_path}': {e}.")
+        finally:
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+                signal.signal(signal.SIGALRM, previous)
+        result["seconds"] = time.perf_counter()-start
+        if result["seconds"]>0:
+            result["pages_per_sec"] = result["pages"]/result["seconds"]
+        return result
+
+    def extract(self, pdf_list, txt_list):
+        return Parallel(n_jobs=self.n_jobs)(delayed(self._extract)\
+            (pdf, txt) for pdf, txt in zip(pdf_list, txt_list))
+
+    def get_worker_stats(self, results):
+        stats = {}
+        for r in results:
+            w = stats.setdefault(r["worker"], {"documents": 0, "pages": 0, "seconds": 0.0})
+            w["documents"] += 1
+            w["pages"] += r["pages"]
+            w["seconds"] += r["seconds"]
+        for w in stats.values():
+            w["pages_per_sec"] = w["pages"]/w["seconds"] if w["seconds"]>0 else None
+        return stats
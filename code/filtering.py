@@ -0,0 +1,95 @@
+# %%
+### prepare
+import os
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+DUPLICATE_PATTERN = re.compile(r"\b(\w+\s*)\1{1,}")
+
+class UposFilter():
+
+    def __init__(self,
+                pos = ("NOUN", "ADJ", "VERB"),
+                min_length = 3,
+                max_length = 18,
+                min_count = 100,
+                min_docs = 50) -> None:
+        self.pos = list(pos)
+        self.min_length = min_length
+        self.max_length = max_length
+        self.min_count = min_count
+        self.min_docs = min_docs
+        pass
+
+    def get_sources(self, dir_name, ids=None):
+        # every shard in the directory, restricted to the documents still in data, a
+        # tagging run returns the shards it wrote itself and needs no listing
+        return [(os.path.join(dir_name, f), ids) for f in sorted(os.listdir(dir_name))
+            if f.endswith(".parquet")]
+
+    def _get_filter(self, ids=None, lemma_set=None):
+        lemma = pc.field("lemma").cast(pa.string())
+        expr = pc.field("pos").cast(pa.string()).isin(self.pos)\
+            & ~pc.field("is_stopword")\
+            & (pc.utf8_length(lemma) >= self.min_length)\
+            & (pc.utf8_length(lemma) <= self.max_length)
+        if ids is not None:
+            expr = expr & pc.field("doc_id").isin(list(ids))
+        if lemma_set is not None:
+            expr = expr & lemma.isin(pa.array(lemma_set, pa.string()))
+        return expr
+
+    def _read(self, path, ids=None, lemma_set=None):
+        # filters are pushed into the scan, only doc_id and lemma are materialized
+        table = ds.dataset(path).to_table(columns=["doc_id", "lemma"],
+            filter=self._get_filter(ids, lemma_set))
+        return table.set_column(1, "lemma", table.column("lemma").cast(pa.string()))
+
+    def get_lemma_stats(self, sources):
+        # a document never spans two shards, so per shard distinct pairs add up exactly
+        stats = None
+        for path, ids in sources:
+            pairs = self._read(path, ids).group_by(["lemma", "doc_id"])\
+                .aggregate([([], "count_all")])
+            shard = pairs.group_by("lemma").aggregate([("count_all", "sum"),
+                ([], "count_all")]).to_pandas().set_index("lemma")
+            shard.columns = ["count", "docs"]
+            stats = shard if stats is None else stats.add(shard, fill_value=0)
+        if stats is None:
+            return pd.DataFrame(columns=["count", "docs"])
+        return stats.astype("int64")
+
+    def get_lemma_set(self, stats):
+        keep = (stats["count"]>self.min_count) & (stats["docs"]>self.min_docs)
+        return list(stats.index[keep])
+
+    def _join_shard(self, table):
+        doc_ids = table.column("doc_id").to_numpy()
+        lemmas = table.column("lemma").to_pylist()
+        texts, start = {}, 0
+        for end in list((doc_ids[1:]!=doc_ids[:-1]).nonzero()[0]+1) + [len(doc_ids)]:
+            if end > start:
+                texts[doc_ids[start]] = " ".join(lemmas[start:end])
+            start = end
+        return texts
+
+    def reconstruct(self, sources, lemma_set, col="reconstructed_text"):
+        texts = {}
+        for path, ids in sources:
+            table = self._read(path, ids, lemma_set)
+            for ind, text in self._join_shard(table).items():
+                texts[ind] = texts[ind] + " " + text if ind in texts else text
+        reconstructed = pd.DataFrame(pd.Series(texts, dtype=object), columns=[col])\
+            .sort_index()
+        reconstructed.index.name = "doc_id"
+        reconstructed[col] = reconstructed[col].map(lambda x: DUPLICATE_PATTERN.sub("\\1", x))
+        return reconstructed
+
+    def run(self, sources, col="reconstructed_text"):
+        self.lemma_stats = self.get_lemma_stats(sources)
+        lemma_set = self.get_lemma_set(self.lemma_stats)
+        print(f"Keeping {len(lemma_set)} of {len(self.lemma_stats)} lemmas.")
+        return self.reconstruct(sources, lemma_set, col)
@@ -7,16 +7,34 @@ import requests
 import magic
 from PyPDF2 import PdfReader
 from joblib import Parallel, delayed
+from downloading import AsyncDownloader
+from manifest import ArtifactManifest
+from conversion import ConversionPool
+from extraction import PdfExtractor
+from scanning import FileScanner
+from corpus import CorpusStore
+from instrumentation import instrument
 
 class DataIngestion():
     
     def __init__(self,
                 docs_file = "../data/unglobalcompact.csv",
                 raw_folder = "../data/raw_files/",
-                data_folder = "../data/") -> None:
+                data_folder = "../data/",
+                manifest_file = None,
+                instrumentation = None) -> None:
         self.docs_file = docs_file
         self.raw_folder = raw_folder
         self.data_folder = data_folder
+        self.manifest = None
+        self.instrumentation = instrumentation
+        self.conversion_params = {"converter": "libreoffice", "format": "pdf"}
+        if manifest_file is not None:
+            self.manifest = ArtifactManifest(manifest_file)
+        if instrumentation is not None:
+            instrumentation.attach(self, ["load_data", "download_reports", "convert_reports",
+                "read_reports", "pack_reports", "save_data"],
+                    ["_download_file", "_convert_row", "_read_row"])
         pass
 
     def _sanitize_name(self, name):
@@ -67,10 +85,22 @@ class DataIngestion():
             print(f"Error downloading '{file_path}': {e}.")
             return None
 
-    def download_reports(self):
+    def _merge_download_stats(self, results):
+        stats = pd.DataFrame(results, index=self.docs_data.index)
+        stats = stats.loc[:, ["status", "http_status", "bytes", "latency", "attempts"]]
+        stats.columns = ["download_" + c for c in stats.columns]
+        self.docs_data = self.docs_data.drop(columns=stats.columns, errors="ignore")\
+            .merge(stats, how="left", left_index=True, right_index=True)
+        return self
+
+    def download_reports(self, engine="joblib", n_jobs=5, **engine_kwargs):
         url_list = self.docs_data["communication_on_progress_file"].values
         path_list = self.docs_data["file_destination"].values
-        Parallel(n_jobs=5)(delayed(self._download_file)\
+        if engine == "async":
+            results = instrument(self.instrumentation, AsyncDownloader(**engine_kwargs),
+                ["_fetch"]).download(url_list, path_list)
+            return self._merge_download_stats(results)
+        Parallel(n_jobs=n_jobs)(delayed(self._download_file)\
             (url, path) for url, path in zip(url_list, path_list))
         return self
     
@@ -87,11 +117,21 @@ class DataIngestion():
         name, extension = os.path.splitext(base_name)
         return os.path.join(*[dir_name, name+".pdf"])
 
-    def _get_metadata(self):
-        self.docs_data["file_type"] = self.docs_data\
-            .apply(lambda x:magic.from_file(x["file_destination"],mime=True), axis=1)
-        self.docs_data["file_size"] = self.docs_data\
-            .apply(lambda x:os.path.getsize(x["file_destination"])/10**6, axis=1)
+    def _scan_metadata(self, **engine_kwargs):
+        files = FileScanner(**engine_kwargs).scan(self.raw_folder)
+        paths = self.docs_data["file_destination"].map(os.path.normpath)
+        self.docs_data["file_type"] = paths.map(files["mime"])
+        self.docs_data["file_size"] = paths.map(files["size"])/10**6
+        return self
+
+    def _get_metadata(self, engine="apply", **engine_kwargs):
+        if engine == "scan":
+            self = self._scan_metadata(**engine_kwargs)
+        else:
+            self.docs_data["file_type"] = self.docs_data\
+                .apply(lambda x:magic.from_file(x["file_destination"],mime=True), axis=1)
+            self.docs_data["file_size"] = self.docs_data\
+                .apply(lambda x:os.path.getsize(x["file_destination"])/10**6, axis=1)
         self.docs_data["converted_file_destination"] = None
         pdf_rows = self.docs_data.file_type=="application/pdf"
         self.docs_data.loc[pdf_rows, "converted_file_destination"] = self.docs_data.loc[pdf_rows, "file_destination"]
@@ -103,12 +143,17 @@ class DataIngestion():
         self.docs_data.loc[conv_rows_ind, "conversion"] = True
         return self
 
+    def _is_converted(self, file_destination, converted_file_destination):
+        if self.manifest is not None:
+            return self.manifest.lookup_file("convert", file_destination,
+                converted_file_destination, self.conversion_params) is not None
+        return os.path.exists(converted_file_destination)
+
     def _convert_row(self, ind):
         file_destination = self.docs_data.loc[ind, "file_destination"]
         converted_file_destination = self._get_conversion_path(file_destination)
         converted_file_dir = os.path.dirname(converted_file_destination)
-        # NOTE: make sure this works
-        if os.path.exists(converted_file_destination):
+        if self._is_converted(file_destination, converted_file_destination):
             print(f"File on '{converted_file_destination}' already exists. Skipping conversion.")
             self.docs_data.loc[ind, "converted_file_destination"] = converted_file_destination
             return self
@@ -118,14 +163,48 @@ class DataIngestion():
             if "error" in status.lower():
                 raise Exception(status)
             self.docs_data.loc[ind, "converted_file_destination"] = self._check_path(converted_file_destination)
+            if self.manifest is not None and self._check_path(converted_file_destination):
+                self.manifest.record_file("convert", file_destination,
+                    converted_file_destination, self.conversion_params)
             print(f"File on '{converted_file_destination}' converted successfully.")
         except Exception as e:
             print(f"Error converting '{file_destination}': {e}.")
         return self
 
-    def convert_reports(self):
-        self = self._get_metadata()
-        for ind in self.docs_data.loc[self.docs_data.conversion,].index:
+    def _convert_pool(self, rows_ind, **engine_kwargs):
+        todo_ind = []
+        for ind in rows_ind:
+            file_destination = self.docs_data.loc[ind, "file_destination"]
+            converted_file_destination = self._get_conversion_path(file_destination)
+            if self._is_converted(file_destination, converted_file_destination):
+                print(f"File on '{converted_file_destination}' already exists. Skipping conversion.")
+                self.docs_data.loc[ind, "converted_file_destination"] = converted_file_destination
+            else:
+                todo_ind.append(ind)
+        file_list = self.docs_data.loc[todo_ind, "file_destination"].values
+        dir_list = [os.path.dirname(self._get_conversion_path(f)) for f in file_list]
+        results = instrument(self.instrumentation, ConversionPool(**engine_kwargs),
+            ["_run"]).convert(file_list, dir_list)
+        results = pd.DataFrame(results, columns=["file_destination",
+            "converted_file_destination", "conversion_status", "conversion_time"])
+        results = results.drop_duplicates("file_destination").set_index("file_destination")\
+            .reindex(file_list).reset_index().set_index(pd.Index(todo_ind))
+        for c in ["converted_file_destination", "conversion_status", "conversion_time"]:
+            if c not in self.docs_data.columns:
+                self.docs_data[c] = None
+            self.docs_data.loc[results.index, c] = results[c].values
+        if self.manifest is not None:
+            for _, r in results.loc[results.conversion_status=="converted",].iterrows():
+                self.manifest.record_file("convert", r["file_destination"],
+                    r["converted_file_destination"], self.conversion_params)
+        return self
+
+    def convert_reports(self, engine="serial", metadata_engine="apply", **engine_kwargs):
+        self = self._get_metadata(metadata_engine)
+        rows_ind = self.docs_data.loc[self.docs_data.conversion,].index
+        if engine == "pool":
+            return self._convert_pool(rows_ind, **engine_kwargs)
+        for ind in rows_ind:
             self = self._convert_row(ind)
         return self
 
@@ -135,12 +214,20 @@ class DataIngestion():
         name, extension = os.path.splitext(base_name)
         return os.path.join(*[dir_name, name+".txt"])
     
-    def _read_row(self, ind, overwrite=False):
+    def _read_row(self, ind, overwrite=False, corpus=None, txt_folder="../data/txt_files/"):
         row = self.docs_data.loc[ind,]
+        if corpus is not None:
+            return self._read_row_corpus(row, overwrite, corpus)
         row["txt_file_destination"] = None
         pdf_path = row["converted_file_destination"]
-        txt_path = self._get_txt_path(pdf_path)
-        if os.path.exists(txt_path) and not overwrite:
+        txt_path = self._get_txt_path(pdf_path, txt_folder)
+        reading_params = {"extractor": "pypdf2", "separator": "/n"}
+        if self.manifest is not None:
+            is_done = self.manifest.lookup_file("read", pdf_path,
+                txt_path, reading_params) is not None
+        else:
+            is_done = os.path.exists(txt_path)
+        if is_done and not overwrite:
             print(f"File on '{txt_path}' already exists. Skipping reading.")
             row["txt_file_destination"] = txt_path
             return row
@@ -156,6 +243,8 @@ class DataIngestion():
                 with open(txt_path, "w") as file:
                     file.write(text)
                 row["txt_file_destination"] = self._check_path(txt_path)
+                if self.manifest is not None:
+                    self.manifest.record_file("read", pdf_path, txt_path, reading_params)
 
                 # Ghostscript extraction, may be used as an alternative
                 #cmd = f"gs -sDEVICE=ocr -r200 -dQUIET -dBATCH -dNOPAUSE -sOutputFile={txt_path} {pdf_path} > conversion.log 2>&1"
@@ -165,15 +254,109 @@ class DataIngestion():
                 print(f"Error reading '{pdf_path}': {e}.")
         return row
 
-    def read_reports(self, overwrite=False):
+    def _read_row_corpus(self, row, overwrite=False, corpus=None):
+        # text goes straight into the packed store, no txt file is written
+        row["corpus_destination"] = None
+        pdf_path = row["converted_file_destination"]
+        if row.name in self.packed_ids and not overwrite:
+            print(f"Report '{row.name}' already packed. Skipping reading.")
+            row["corpus_destination"] = corpus.dir_name
+            return row
+        print(f"Reading '{pdf_path}'.")
+        try:
+            # stamped before reading, a pdf replaced meanwhile is read again next time
+            stamp = corpus.get_stamp(pdf_path)
+            reader = PdfReader(pdf_path)
+            corpus.append(row.name, "/n".join([page.extract_text() for page in reader.pages]),
+                stamp)
+            row["corpus_destination"] = corpus.dir_name
+        except Exception as e:
+            print(f"Error reading '{pdf_path}': {e}.")
+        return row
+
+    def _read_stream(self, rows_ind, overwrite=False, txt_folder="../data/txt_files/",
+            **engine_kwargs):
+        extractor = instrument(self.instrumentation, PdfExtractor(**engine_kwargs),
+            ["_extract"])
+        reading_params = {"extractor": "pypdf2-stream", "separator": extractor.separator,
+            "max_pages": extractor.max_pages}
+        pdf_list = self.docs_data.loc[rows_ind, "converted_file_destination"].values
+        txt_list = [self._get_txt_path(p, txt_folder) for p in pdf_list]
+        todo = []
+        for pdf_path, txt_path in zip(pdf_list, txt_list):
+            if self.manifest is not None:
+                is_done = self.manifest.lookup_file("read", pdf_path,
+                    txt_path, reading_params) is not None
+            else:
+                is_done = os.path.exists(txt_path)
+            if is_done and not overwrite:
+                print(f"File on '{txt_path}' already exists. Skipping reading.")
+            else:
+                todo.append((pdf_path, txt_path))
+        results = extractor.extract([t[0] for t in todo], [t[1] for t in todo])
+        self.extraction_stats = extractor.get_worker_stats(results)
+        results = pd.DataFrame(results, columns=["converted_file_destination",
+            "txt_file_destination", "status", "n_pages", "pages_per_sec"])\
+                .rename(columns={"status": "extraction_status"})\
+                .set_index("converted_file_destination")
+        if self.manifest is not None:
+            for pdf_path, r in results.loc[results.txt_file_destination.notnull(),].iterrows():
+                self.manifest.record_file("read", pdf_path, r["txt_file_destination"],
+                    reading_params)
+        rows = self.docs_data.loc[rows_ind, ["converted_file_destination"]]
+        rows["txt_file_destination"] = [results.loc[p, "txt_file_destination"]
+            if p in results.index else self._check_path(t)
+                for p, t in zip(pdf_list, txt_list)]
+        rows = rows.join(results.drop(columns="txt_file_destination"),
+            on="converted_file_destination").drop(columns="converted_file_destination")
+        self.docs_data = self.docs_data.drop(columns=rows.columns, errors="ignore")\
+            .merge(rows, how="left", left_index=True, right_index=True)
+        return self
+
+    def read_reports(self, overwrite=False, engine="joblib", n_jobs=7, corpus_dir=None,
+            txt_folder="../data/txt_files/", **engine_kwargs):
         rows_ind = self.docs_data.index[self.docs_data.converted_file_destination.notnull()]
-        rows_ls = Parallel(n_jobs=7)(delayed(self._read_row)\
-            (ind, overwrite) for ind in rows_ind)
-        self.docs_data = self.docs_data.merge(
-            pd.DataFrame(rows_ls)[["txt_file_destination"]],
+        if engine == "stream" or corpus_dir is None:
+            os.makedirs(txt_folder, exist_ok=True)
+        if engine == "stream":
+            self._read_stream(rows_ind, overwrite, txt_folder, n_jobs=n_jobs, **engine_kwargs)
+            return self if corpus_dir is None\
+                else self.pack_reports(corpus_dir, overwrite=overwrite)
+        corpus, columns = None, ["txt_file_destination"]
+        if corpus_dir is not None:
+            corpus, columns = CorpusStore(corpus_dir), ["corpus_destination"]
+            # reports whose pdf changed since they were packed are read again
+            self.packed_ids = {ind for ind, pdf_path in self.docs_data.loc[rows_ind,
+                "converted_file_destination"].items() if corpus.is_current(ind, pdf_path)}
+        rows_ls = Parallel(n_jobs=n_jobs)(delayed(self._read_row)\
+            (ind, overwrite, corpus, txt_folder) for ind in rows_ind)
+        self.docs_data = self.docs_data.drop(columns=columns, errors="ignore").merge(
+            pd.DataFrame(rows_ls)[columns],
             how="left", left_index=True, right_index=True)
         return self
 
+    def pack_reports(self, corpus_dir="../data/corpus/", remove_files=False, overwrite=False):
+        # extracted txt files are appended to the packed store, one open per report
+        corpus = CorpusStore(corpus_dir)
+        rows = self.docs_data.loc[self.docs_data.txt_file_destination.notnull(),
+            "txt_file_destination"]
+        # a txt file changed since it was packed counts as not packed
+        packed = {ind for ind, txt_path in rows.items() if corpus.is_current(ind, txt_path)}
+        destinations = pd.Series(None, index=self.docs_data.index, dtype=object)
+        for ind, txt_path in rows.items():
+            try:
+                if ind not in packed or overwrite:
+                    corpus.append_file(ind, txt_path)
+                destinations[ind] = corpus_dir
+                if remove_files:
+                    os.remove(txt_path)
+            except Exception as e:
+                print(f"Error packing '{txt_path}': {e}.")
+        self.docs_data["corpus_destination"] = destinations
+        if remove_files:
+            self.docs_data.loc[destinations.notnull(), "txt_file_destination"] = None
+        return self
+
     def save_data(self, file_path=None):
         if file_path is None:
             file_path = self.data_folder+"ingested.parquet"
@@ -0,0 +1,215 @@
+# %%
+### prepare
+import os
+import json
+import time
+import uuid
+import fcntl
+import inspect
+import cProfile
+import resource
+import pandas as pd
+
+def instrument(instrumentation, obj, workers):
+    # engines created inside a stage report their worker calls, nothing without tracking
+    if instrumentation is not None:
+        instrumentation.attach(obj, [], workers)
+    return obj
+
+class Instrumentation():
+
+    def __init__(self,
+                log_file = "../data/run_log.jsonl",
+                profile = False,
+                profile_dir = "../data/profiles/",
+                profile_top = 10,
+                run_id = None) -> None:
+        self.log_file = log_file
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.profile_top = profile_top
+        self.run_id = run_id or time.strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:6]
+        pass
+
+    def attach(self, obj, stages, workers):
+        # instance attributes shadow the methods, calls go to the class functions
+        for name in stages:
+            setattr(obj, name, TimedCall(self, name, obj, "stage"))
+        for name in workers:
+            setattr(obj, name, TimedCall(self, name, obj, "worker"))
+        return obj
+
+    def write(self, record):
+        # one locked append per record, safe from any number of worker processes
+        os.makedirs(os.path.dirname(self.log_file) or ".", exist_ok=True)
+        line = json.dumps(dict(record, run_id=self.run_id), default=str) + "\n"
+        with open(self.log_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(line)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return self
+
+    def get_rss(self):
+        # resident memory right now, the second field of statm is in pages
+        try:
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1])*os.sysconf("SC_PAGE_SIZE")/2**20
+        except (OSError, ValueError):
+            return None
+
+    def get_max_rss(self, who=resource.RUSAGE_SELF):
+        # lifetime peak of the process, it never falls inside a reused pool worker,
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(who).ru_maxrss/1024
+
+    def get_file_bytes(self, values):
+        # sizes of the files a call read or wrote, found among its arguments and result
+        size = 0
+        for v in values:
+            if isinstance(v, str) and len(v)<4096 and os.path.isfile(v):
+                size += os.path.getsize(v)
+        return size
+
+    def _get_profile_path(self, name, seconds):
+        path = os.path.join(self.profile_dir, self.run_id, name)
+        os.makedirs(path, exist_ok=True)
+        return os.path.join(path, f"{seconds:014.6f}_{os.getpid()}_{uuid.uuid4().hex[:6]}.prof")
+
+    def prune_profiles(self, name=None):
+        # only the slowest profile_top calls of every worker method are kept, file names
+        # start with the duration, workers may be pruning the same directory at once
+        root = os.path.join(self.profile_dir, self.run_id)
+        if not os.path.isdir(root):
+            return self
+        for name in ([name] if name is not None else os.listdir(root)):
+            files = sorted(os.listdir(os.path.join(root, name)), reverse=True)
+            for f in files[self.profile_top:]:
+                try:
+                    os.remove(os.path.join(root, name, f))
+                except FileNotFoundError:
+                    pass
+        return self
+
+    def load(self, run_id=None):
+        with open(self.log_file, "r") as f:
+            log = pd.DataFrame([json.loads(line) for line in f])
+        if run_id != "all":
+            log = log.loc[log.run_id==(run_id or self.run_id),]
+        return log.reset_index(drop=True)
+
+    def to_parquet(self, path=None, run_id=None):
+        if path is None:
+            path = os.path.splitext(self.log_file)[0] + ".parquet"
+        self.load(run_id).to_parquet(path)
+        return self
+
+    def summary(self, run_id=None):
+        log = self.load(run_id)
+        return log.groupby(["kind", "name"]).agg(calls=("wall", "size"),
+            wall=("wall", "sum"), cpu=("cpu", "sum"), wall_max=("wall", "max"),
+                rss_mb=("rss_mb", "max"), rss_delta_mb=("rss_delta_mb", "max"),
+                max_rss_mb=("max_rss_mb", "max"), items=("items", "sum"),
+                    file_bytes=("file_bytes", "sum"), failures=("failed", "sum"))
+
+class TimedCall():
+
+    def __init__(self, instrumentation, name, obj, kind = "worker") -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+        self.obj = obj
+        self.kind = kind
+        pass
+
+    def _get_items(self, args, result):
+        # stages return their owner, its frame length is the number of documents, batch
+        # workers return one entry per document or take their ids as first sized argument
+        if self.kind == "stage":
+            frame = getattr(result, "docs_data", getattr(result, "data", None))
+            return len(frame) if isinstance(frame, pd.DataFrame) else None
+        if isinstance(result, (pd.DataFrame, list)):
+            return len(result)
+        for arg in args:
+            if hasattr(arg, "__len__") and not isinstance(arg, (str, bytes, dict)):
+                return len(arg)
+        return 1
+
+    def _get_values(self, args, kwargs, result):
+        values = list(args) + list(kwargs.values())
+        if isinstance(result, pd.Series):
+            values += list(result.values)
+        elif isinstance(result, dict):
+            values += list(result.values())
+        else:
+            values.append(result)
+        return values
+
+    def _get_key(self, args):
+        # the document a worker call is about, its first plain argument
+        for arg in args:
+            if isinstance(arg, (str, int)):
+                return str(arg)
+        return None
+
+    def _start(self, profile=True):
+        tracker = self.instrumentation
+        profiler = None
+        if profile and tracker.profile and self.kind == "worker":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return {"profiler": profiler, "start": time.perf_counter(),
+            "start_cpu": time.process_time(), "rss": tracker.get_rss()}
+
+    def _finish(self, state, args, kwargs, result, error, is_async=False):
+        tracker, profiler = self.instrumentation, state["profiler"]
+        if profiler is not None:
+            profiler.disable()
+        wall = time.perf_counter()-state["start"]
+        if profiler is not None:
+            profiler.dump_stats(tracker._get_profile_path(self.name, wall))
+            tracker.prune_profiles(self.name)
+        max_rss = tracker.get_max_rss()
+        if self.kind == "stage":
+            max_rss = max(max_rss, tracker.get_max_rss(resource.RUSAGE_CHILDREN))
+            if tracker.profile:
+                tracker.prune_profiles()
+        rss = tracker.get_rss()
+        # engines report failed documents in their result instead of raising
+        failed = error is not None or (isinstance(result, dict)
+            and result.get("status") in ("failed", "timeout"))
+        tracker.write({"kind": self.kind, "name": self.name, "pid": os.getpid(),
+            "start": time.time()-wall, "wall": wall,
+            # other coroutines run on the same thread meanwhile, their cpu is not this call's
+            "cpu": None if is_async else time.process_time()-state["start_cpu"],
+            "rss_mb": rss, "rss_delta_mb": None if rss is None or state["rss"] is None
+                else rss-state["rss"], "max_rss_mb": max_rss,
+            "items": self._get_items(args, result),
+            "file_bytes": tracker.get_file_bytes(self._get_values(args, kwargs, result)),
+            "failed": failed, "error": error, "key": self._get_key(args)})
+        return self
+
+    async def _call_async(self, func, args, kwargs):
+        state, result, error = self._start(profile=False), None, None
+        try:
+            result = await func(self.obj, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._finish(state, args, kwargs, result, error, is_async=True)
+
+    def __call__(self, *args, **kwargs):
+        func = getattr(type(self.obj), self.name)
+        if inspect.iscoroutinefunction(func):
+            return self._call_async(func, args, kwargs)
+        state, result, error = self._start(), None, None
+        try:
+            result = func(self.obj, *args, **kwargs)
+            return result
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._finish(state, args, kwargs, result, error)
@@ -0,0 +1,108 @@
+# %%
+### prepare
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from contextlib import closing
+
+class ArtifactManifest():
+
+    def __init__(self, db_path = "../data/manifest.sqlite") -> None:
+        self.db_path = db_path
+        with closing(self._connect()) as con, con:
+            con.execute("""CREATE TABLE IF NOT EXISTS artifacts (
+                stage TEXT, input_hash TEXT, params_hash TEXT,
+                input_path TEXT, output_path TEXT, created REAL,
+                PRIMARY KEY (stage, input_hash, params_hash))""")
+            con.execute("""CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT)""")
+        pass
+
+    def _connect(self):
+        # connections are opened per call, the manifest is shared by joblib workers
+        con = sqlite3.connect(self.db_path, timeout=60)
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def hash_text(self, text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def hash_params(self, params):
+        return hashlib.sha256(json.dumps(params, sort_keys=True,
+            default=str).encode("utf-8")).hexdigest()
+
+    def hash_file(self, path, chunk_size=2**20):
+        stat = os.stat(path)
+        with closing(self._connect()) as con:
+            cached = con.execute("SELECT size, mtime, hash FROM file_hashes WHERE path=?",
+                (path,)).fetchone()
+        if cached is not None and cached[0]==stat.st_size and cached[1]==stat.st_mtime:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO file_hashes VALUES (?,?,?,?)",
+                (path, stat.st_size, stat.st_mtime, digest.hexdigest()))
+        return digest.hexdigest()
+
+    def lookup(self, stage, input_hash, params=None):
+        with closing(self._connect()) as con:
+            row = con.execute("""SELECT output_path FROM artifacts
+                WHERE stage=? AND input_hash=? AND params_hash=?""",
+                (stage, input_hash, self.hash_params(params))).fetchone()
+        if row is None or row[0] is None or not os.path.exists(row[0]):
+            return None
+        return row[0]
+
+    def record(self, stage, input_hash, output_path, params=None, input_path=None):
+        with closing(self._connect()) as con, con:
+            con.execute("INSERT OR REPLACE INTO artifacts VALUES (?,?,?,?,?,?)",
+                (stage, input_hash, self.hash_params(params),
+                    input_path, output_path, time.time()))
+        return self
+
+    def _get_file_params(self, output_path, params):
+        # identical inputs at different paths still own separate outputs
+        return dict(params or {}, output_path=output_path)
+
+    def lookup_file(self, stage, input_path, output_path, params=None):
+        # artifacts produced before the manifest existed are adopted when newer than the input
+        input_hash = self.hash_file(input_path)
+        params = self._get_file_params(output_path, params)
+        found = self.lookup(stage, input_hash, params)
+        if found is None and os.path.exists(output_path)\
+                and os.path.getmtime(output_path)>=os.path.getmtime(input_path)\
+                and self._is_unrecorded(stage, input_path):
+            self.record(stage, input_hash, output_path, params, input_path)
+            found = output_path
+        return found
+
+    def record_file(self, stage, input_path, output_path, params=None):
+        return self.record(stage, self.hash_file(input_path), output_path,
+            self._get_file_params(output_path, params), input_path)
+
+    def _is_unrecorded(self, stage, input_path):
+        with closing(self._connect()) as con:
+            row = con.execute("SELECT 1 FROM artifacts WHERE stage=? AND input_path=?",
+                (stage, input_path)).fetchone()
+        return row is None
+
+    def lookup_many(self, stage, input_hashes, params=None):
+        params_hash = self.hash_params(params)
+        with closing(self._connect()) as con:
+            rows = [con.execute("""SELECT output_path FROM artifacts
+                WHERE stage=? AND input_hash=? AND params_hash=?""",
+                (stage, h, params_hash)).fetchone() for h in input_hashes]
+        return [r[0] if r is not None and r[0] is not None and os.path.exists(r[0])
+            else None for r in rows]
+
+    def record_many(self, stage, input_hashes, output_path, params=None):
+        params_hash, created = self.hash_params(params), time.time()
+        with closing(self._connect()) as con, con:
+            con.executemany("INSERT OR REPLACE INTO artifacts VALUES (?,?,?,?,?,?)",
+                [(stage, h, params_hash, None, output_path, created) for h in input_hashes])
+        return self
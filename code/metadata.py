@@ -0,0 +1,83 @@
+# %%
+### prepare
+import re
+import pandas as pd
+import pycld2 as cld2
+from joblib import Parallel, delayed
+
+# ascii \w characters map to "a", everything else to a space, word runs are then counted
+WORD_CHARS = b"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_"
+WORD_TABLE = bytes(ord("a") if c in WORD_CHARS else ord(" ") for c in range(256))
+WORD_PATTERN = re.compile(r"\w+")
+
+class TextMetadata():
+
+    COLUMNS = ["n_chars", "n_words", "n_sentences", "language", "language_score"]
+
+    def __init__(self,
+                sample_chars = 2**16,
+                n_windows = 8,
+                full_text = False,
+                n_jobs = 8,
+                chunk_size = 500) -> None:
+        self.sample_chars = sample_chars
+        self.n_windows = n_windows
+        self.full_text = full_text
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        pass
+
+    def _count_words(self, text):
+        # same as len(re.split(r"\w+", text)), i.e. the number of word runs plus one
+        if text.isascii():
+            mapped = text.encode("ascii").translate(WORD_TABLE)
+            return mapped.count(b" a") + mapped.startswith(b"a") + 1
+        return sum(1 for _ in WORD_PATTERN.finditer(text)) + 1
+
+    def _count_sentences(self, text):
+        # same as len(re.split(r"[.?!]", text))
+        return text.count(".") + text.count("?") + text.count("!") + 1
+
+    def _sample(self, text):
+        # evenly spaced windows cut at spaces, so a title page does not decide the language
+        if self.full_text or len(text) <= self.sample_chars:
+            return text
+        size = self.sample_chars//self.n_windows
+        step = (len(text)-size)//max(1, self.n_windows-1)
+        windows = []
+        for i in range(self.n_windows):
+            start = text.find(" ", i*step, i*step+size)+1 or i*step
+            windows.append(text[start:start+size])
+        return " ".join(windows)
+
+    def _language(self, text):
+        # vectors are requested as before, they change the estimate for some texts
+        details = cld2.detect(self._sample(text), returnVectors=True)[2]
+        return details[0][1], details[0][2]/100.0
+
+    def _describe(self, ids, texts):
+        rows = [(len(text), self._count_words(text), self._count_sentences(text))\
+            + self._language(text) for text in texts]
+        return pd.DataFrame(rows, index=ids, columns=self.COLUMNS)
+
+    def _describe_shard(self, path, ids):
+        # the worker reads its shard itself, no text is sent to or from the pool
+        shard = pd.read_parquet(path, filters=[("doc_id", "in", list(ids))])\
+            .set_index("doc_id")
+        shard = shard.loc[shard.loc[:,"text"]!="",]
+        return self._describe(shard.index, shard.loc[:,"text"].values)
+
+    def _empty(self):
+        return pd.DataFrame(columns=self.COLUMNS)
+
+    def describe(self, ids, texts):
+        ids, texts = list(ids), list(texts)
+        frames = Parallel(n_jobs=self.n_jobs)(delayed(self._describe)\
+            (ids[i:i+self.chunk_size], texts[i:i+self.chunk_size])
+                for i in range(0, len(ids), self.chunk_size))
+        return pd.concat(frames) if frames else self._empty()
+
+    def describe_shards(self, sources):
+        frames = Parallel(n_jobs=self.n_jobs)(delayed(self._describe_shard)\
+            (path, ids) for path, ids in sources)
+        return pd.concat(frames) if frames else self._empty()
@@ -0,0 +1,97 @@
+# %%
+### prepare
+import numpy as np
+import pandas as pd
+from itertools import islice
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+class NgramCounter():
+
+    def __init__(self,
+                ngram_range = (1,1),
+                max_features = 10000,
+                n_buckets = 2**20,
+                oversample = 4,
+                batch_size = 1000,
+                cache = None) -> None:
+        self.ngram_range = ngram_range
+        self.max_features = max_features
+        self.n_buckets = n_buckets
+        self.oversample = oversample
+        self.batch_size = batch_size
+        self.cache = cache
+        pass
+
+    def _get_budgets(self):
+        # an int is one budget over the whole range, a dict gives every n its own
+        if isinstance(self.max_features, dict):
+            return {n: self.max_features[n] for n in self._get_ns()}
+        return None
+
+    def _get_ns(self):
+        return list(range(self.ngram_range[0], self.ngram_range[1]+1))
+
+    def _to_stats(self, ngrams, frequency):
+        stats = pd.DataFrame({"ngram": ngrams, "frequency": frequency})
+        stats.insert(0, "n", stats.ngram.str.count(" ")+1)
+        return stats
+
+    def _sum(self, ngram_range, texts, max_features=None, cached=False):
+        if cached and self.cache is not None:
+            counts, ngrams = self.cache.get_counts(texts, ngram_range, max_features)
+        else:
+            cv = CountVectorizer(ngram_range=ngram_range, max_features=max_features)
+            counts, ngrams = cv.fit_transform(texts), cv.get_feature_names_out()
+        # column sums straight from the csr matrix, nothing is densified
+        return ngrams, np.asarray(counts.sum(axis=0)).ravel()
+
+    def count(self, texts):
+        budgets = self._get_budgets()
+        if budgets is None:
+            return self._to_stats(*self._sum(self.ngram_range, texts, self.max_features, True))
+        stats = [self._to_stats(*self._sum((n,n), texts, k, True)) for n, k in budgets.items()]
+        return pd.concat(stats, ignore_index=True)
+
+    def _iter_batches(self, texts):
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def _get_hasher(self, n):
+        return HashingVectorizer(ngram_range=(n,n), n_features=self.n_buckets,
+            alternate_sign=False, norm=None)
+
+    def _get_budget(self, n):
+        budgets = self._get_budgets()
+        return self.max_features if budgets is None else budgets[n]
+
+    def count_hashed(self, texts):
+        # texts are iterated twice, bucket totals first, then exact counts of the
+        # n-grams that fall into the heaviest buckets
+        ns = self._get_ns()
+        hashers = {n: self._get_hasher(n) for n in ns}
+        buckets = {n: np.zeros(self.n_buckets, dtype=np.int64) for n in ns}
+        for batch in self._iter_batches(texts):
+            for n in ns:
+                buckets[n] += np.asarray(hashers[n].transform(batch).sum(axis=0))\
+                    .ravel().astype(np.int64)
+        candidates = {n: np.argsort(buckets[n])[::-1][:self._get_budget(n)*self.oversample]
+            for n in ns}
+        counts = {n: pd.Series(dtype=np.int64) for n in ns}
+        for batch in self._iter_batches(texts):
+            for n in ns:
+                ngrams, frequency = self._sum((n,n), batch)
+                # every name is a single n-gram, so it hashes back to exactly one bucket
+                keep = np.isin(hashers[n].transform(ngrams).indices, candidates[n])
+                counts[n] = counts[n].add(pd.Series(frequency[keep], index=ngrams[keep]),
+                    fill_value=0)
+        if self._get_budgets() is None:
+            # one budget over the whole range, as the vectorizer would apply it
+            counts = pd.concat(counts.values()).nlargest(self.max_features).sort_index()
+            return self._to_stats(counts.index.values, counts.values.astype(np.int64))
+        stats = [counts[n].nlargest(self._get_budget(n)).sort_index() for n in ns]
+        return pd.concat([self._to_stats(s.index.values, s.values.astype(np.int64))
+            for s in stats], ignore_index=True)
@@ -0,0 +1,210 @@
+# %%
+### prepare
+import re
+import codecs
+import string
+from itertools import accumulate, compress, count, islice
+from operator import add, eq
+
+# equivalent rewrites of the reference patterns that let the engine skip ahead
+TAG_PATTERN = re.compile(r"<[^\n>]*>")
+URL_PATTERN = re.compile(r"(?=[sfh])s?(?:f|ht)tps?://\S+\b")
+EMAIL_PATTERN = re.compile(r"^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$")
+WORD_PATTERN = re.compile(r"[a-z]+")
+ALLOWED_CHARS = string.ascii_lowercase + " '.,?!:"
+BOUNDARY_CHARS = "'.,?!:"
+CHAR_TABLE = bytes(c if chr(c) in ALLOWED_CHARS else ord(" ") for c in range(256))
+WORD_TABLE = bytes.maketrans(BOUNDARY_CHARS.encode(), b" "*len(BOUNDARY_CHARS))
+codecs.register_error("normalization_space",
+    lambda e: (" "*(e.end-e.start), e.end))
+
+def regex_normalize(text):
+    # reference implementation, kept for golden comparisons and benchmarks
+    text = text.lower()
+    text = re.sub(r"<.*?>|</.*?>","", text)
+    text = re.sub(r"(s?)(f|ht)tp(s?)://\S+\b","", text)
+    text = re.sub(r"^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$","", text) #email
+    text = re.sub(r"\\-","", text)
+    text = re.sub("[^a-z '.,?!:]"," ", text)
+    text = re.sub(r"\b(\w+\s*)\1{1,}", " ", text) #dupli "\\1"
+    return re.sub(r" +"," ", text)
+
+class TextNormalizer():
+
+    def __init__(self, chunk_size = 2**20) -> None:
+        self.chunk_size = chunk_size
+        self.periods = {}
+        pass
+
+    def _strip_urls(self, text):
+        # the engine only runs next to "://", a match can start at most 6 chars before it
+        out, emitted = [], 0
+        while True:
+            found = text.find("://", emitted)
+            if found == -1:
+                break
+            m = URL_PATTERN.search(text, max(emitted, found-6))
+            if m is None:
+                break
+            out.append(text[emitted:m.start()])
+            emitted = m.end()
+        out.append(text[emitted:])
+        return "".join(out)
+
+    def _squeeze_spaces(self, text):
+        # only valid after cleaning, when a plain space is the only whitespace left
+        body = " ".join(text.split())
+        if not body:
+            return " " if text else ""
+        return (" " if text[0] == " " else "") + body + (" " if text[-1] == " " else "")
+
+    def _strip(self, text):
+        text = text.lower()
+        text = TAG_PATTERN.sub("", text)
+        return self._strip_urls(text)
+
+    def _translate(self, text, is_whole=False):
+        if is_whole and "@" in text and "\n" not in text[:-1]:
+            # anchored without MULTILINE, only a single-line document can match
+            m = EMAIL_PATTERN.match(text)
+            if m is not None:
+                text = text[m.end():]
+        text = text.replace("\\-", "")
+        # one code point outside ascii becomes one space, the byte table does the rest
+        return text.encode("ascii", "normalization_space")\
+            .translate(CHAR_TABLE).decode("ascii")
+
+    def _clean(self, text, is_whole=False):
+        return self._translate(self._strip(text), is_whole)
+
+    def _get_period(self, word):
+        # longest k<=len/2 with word[k:2k]==word[:k], z-function keeps long words linear
+        n = len(word)
+        k = word.rfind(word[:1], 1, n//2+1)
+        if k == -1:
+            return 0
+        if n < 64:
+            while k > 0:
+                if word.startswith(word[:k], k):
+                    return k
+                k = word.rfind(word[:1], 1, k)
+            return 0
+        z, left, right = [0]*n, 0, 0
+        for i in range(1, n):
+            if i < right:
+                z[i] = min(right-i, z[i-left])
+            while i+z[i] < n and word[z[i]] == word[i+z[i]]:
+                z[i] += 1
+            if i+z[i] > right:
+                left, right = i, i+z[i]
+        for k in range(n//2, 0, -1):
+            if z[k] >= k:
+                return k
+        return 0
+
+    def _repeat_end(self, text, start, group):
+        end = start
+        while text.startswith(group, end):
+            end += len(group)
+        return end
+
+    def _match_end(self, text, start):
+        # mirrors the backtracking order of r"\b(\w+\s*)\1{1,}" at a word start
+        word_end = WORD_PATTERN.match(text, start).end()
+        space_end = word_end
+        while space_end < len(text) and text[space_end] == " ":
+            space_end += 1
+        if space_end > word_end:
+            end = self._repeat_end(text, space_end, text[start:space_end])
+            if end > space_end:
+                return end
+        word = text[start:word_end].encode("ascii")
+        period = self.periods.get(word)
+        if period is None:
+            period = self._get_period(word)
+        if period:
+            return self._repeat_end(text, start+period, text[start:start+period])
+        return None
+
+    def _get_periodic(self, words):
+        # word periods are cached across documents, the vocabulary is mostly shared
+        if len(self.periods) > 10**6:
+            self.periods.clear()
+        for word in words.difference(self.periods):
+            self.periods[word] = self._get_period(word)
+        return {w for w in words if self.periods[w]}
+
+    def _get_candidates(self, text):
+        # a duplicate match starts at a word that equals the next word or has a
+        # period of its own, both are found on the word list at C speed
+        parts = text.encode("ascii").translate(WORD_TABLE).split(b" ")
+        offsets = list(compress(map(add, accumulate(map(len, parts), initial=0), count()), parts))
+        words = list(filter(None, parts))
+        periodic = self._get_periodic(set(words))
+        repeated = compress(count(), map(eq, words, islice(words, 1, None)))
+        with_period = compress(count(), map(periodic.__contains__, words))
+        return [offsets[i] for i in sorted(set(repeated).union(with_period))]
+
+    def _collapse(self, text):
+        # linear replacement of the duplicate substitution, only candidates are checked
+        out, emitted = [], 0
+        for start in self._get_candidates(text):
+            if start < emitted:
+                continue
+            end = self._match_end(text, start)
+            if end is not None:
+                out.append(text[emitted:start])
+                out.append(" ")
+                emitted = end
+        out.append(text[emitted:])
+        return "".join(out)
+
+    def _iter_chunks(self, file):
+        while True:
+            chunk = file.read(self.chunk_size)
+            if not chunk:
+                return
+            # chunks end on a newline, the cleaning patterns never cross lines
+            yield chunk + file.readline()
+
+    def _iter_cleaned(self, chunks):
+        # the email pattern sees the whole document, so stripped text is held back for
+        # as long as it is still a single line, tags and urls may remove every later line
+        head = ""
+        for chunk in chunks:
+            text = self._strip(chunk)
+            if head is not None:
+                head += text
+                if "\n" not in head[:-1]:
+                    continue
+                text, head = head, None
+            yield self._translate(text)
+        if head is not None:
+            yield self._translate(head, is_whole=True)
+
+    def iter_normalize(self, chunks):
+        cleaned = self._iter_cleaned(chunks)
+        text, following = next(cleaned, ""), next(cleaned, None)
+        carry, ends_with_space = "", False
+        while text is not None:
+            text = carry + text
+            if following is None:
+                cut = len(text)
+            else:
+                # duplicates never span punctuation, text up to the last mark is final
+                cut = max(text.rfind(c) for c in BOUNDARY_CHARS)+1
+            piece, carry = self._squeeze_spaces(self._collapse(text[:cut])), text[cut:]
+            if ends_with_space and piece.startswith(" "):
+                piece = piece[1:]
+            if piece:
+                ends_with_space = piece.endswith(" ")
+                yield piece
+            text = following
+            following = next(cleaned, None) if following is not None else None
+
+    def normalize(self, text):
+        return self._squeeze_spaces(self._collapse(self._clean(text, is_whole=True)))
+
+    def normalize_file(self, file_path):
+        with open(file_path, "r") as file:
+            return "".join(self.iter_normalize(self._iter_chunks(file)))
@@ -0,0 +1,197 @@
+# %%
+### prepare
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import subprocess
+import pandas as pd
+from joblib import Parallel, delayed
+from processing import DataProcessing
+from filtering import UposFilter
+
+class ShardedProcessing():
+
+    def __init__(self,
+                n_shards = 4,
+                data_file = "../data/ingested.parquet",
+                work_dir = "../data/partitions/",
+                processing_kwargs = None,
+                preprocess_kwargs = None,
+                upos_kwargs = None,
+                metadata_kwargs = None,
+                min_count = 100,
+                min_docs = 50,
+                stream_filter = False) -> None:
+        self.n_shards = n_shards
+        self.data_file = data_file
+        self.work_dir = work_dir
+        self.processing_kwargs = processing_kwargs or {}
+        self.preprocess_kwargs = preprocess_kwargs or {}
+        self.upos_kwargs = upos_kwargs or {}
+        self.metadata_kwargs = metadata_kwargs or {}
+        self.min_count = min_count
+        self.min_docs = min_docs
+        self.stream_filter = stream_filter
+        pass
+
+    def get_shard_ids(self, index):
+        # a stable hash of the document index, python's own hash is salted per process
+        return pd.Series([int.from_bytes(hashlib.md5(str(ind).encode("utf-8")).digest()[:8],
+            "little") % self.n_shards for ind in index], index=index)
+
+    def get_shard_dir(self, shard_id):
+        # the shard count is part of the name, outputs of other partitionings never mix
+        return os.path.join(self.work_dir, f"shard_{shard_id:04d}_of_{self.n_shards:04d}/")
+
+    def _get_paths(self, shard_id):
+        shard_dir = self.get_shard_dir(shard_id)
+        return {"text_shards": os.path.join(shard_dir, "text_shards/"),
+            "upos_files": os.path.join(shard_dir, "upos_files/"),
+            "data": os.path.join(shard_dir, "shard.parquet"),
+            "lemma_stats": os.path.join(shard_dir, "lemma_stats.parquet"),
+            "sources": os.path.join(shard_dir, "sources.json"),
+            "done": os.path.join(shard_dir, "done.json")}
+
+    def _write_json(self, path, obj):
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(obj, f)
+        os.replace(tmp_file, path)
+        return self
+
+    def run_shard(self, shard_id):
+        # map step of one node: preprocess, tag and count lemmas of its own documents
+        paths = self._get_paths(shard_id)
+        if os.path.exists(paths["done"]):
+            os.remove(paths["done"])
+        for d in ["text_shards", "upos_files"]:
+            # without a manifest, upos files are numbered by batch, old ones would mix in
+            if d == "text_shards" or "manifest_file" not in self.processing_kwargs:
+                shutil.rmtree(paths[d], ignore_errors=True)
+            os.makedirs(paths[d], exist_ok=True)
+        processing = DataProcessing(self.data_file, **self.processing_kwargs)
+        processing.load_data()
+        processing.data = processing.data.loc[
+            self.get_shard_ids(processing.data.index)==shard_id,]
+        processing.preprocess_reports(stream=True, dir_name=paths["text_shards"],
+            **self.preprocess_kwargs)
+        sources = processing._tag_upos(dir_name=paths["upos_files"], **self.upos_kwargs)
+        upos_filter = UposFilter(min_count=self.min_count, min_docs=self.min_docs)
+        upos_filter.get_lemma_stats(sources).to_parquet(paths["lemma_stats"])
+        processing.data.to_parquet(paths["data"])
+        self._write_json(paths["sources"], [(p, [int(i) for i in ids]) for p, ids in sources])
+        # written last, the reduce step only trusts shards that got this far
+        self._write_json(paths["done"], {"shard_id": shard_id, "n_shards": self.n_shards,
+            "data_file": self.data_file, "n_docs": len(processing.data)})
+        print(f"Shard {shard_id} of {self.n_shards} processed {len(processing.data)} documents.")
+        return self
+
+    def _check_shards(self):
+        if self.n_shards < 1:
+            raise ValueError(f"At least one shard is needed, got {self.n_shards}.")
+        missing = [k for k in range(self.n_shards)
+            if not os.path.exists(self._get_paths(k)["done"])]
+        if missing:
+            raise ValueError(f"Shards {missing} of {self.n_shards} are not processed.")
+        return self
+
+    def get_lemma_stats(self):
+        # a document lives in exactly one shard, so shard counts add up to the global ones
+        stats = None
+        for k in range(self.n_shards):
+            shard = pd.read_parquet(self._get_paths(k)["lemma_stats"])
+            stats = shard if stats is None else stats.add(shard, fill_value=0)
+        if stats is None:
+            return pd.DataFrame(columns=["count", "docs"], dtype="int64")
+        return stats.astype("int64")
+
+    def _reconstruct_shard(self, shard_id, lemma_set):
+        with open(self._get_paths(shard_id)["sources"], "r") as f:
+            sources = json.load(f)
+        if self.stream_filter:
+            return UposFilter().reconstruct(sources, lemma_set)
+        processing = DataProcessing()
+        # a shard without documents has no upos files, its frame is empty but typed
+        upos = processing._read_upos(sources)
+        return processing._reconstruct_upos(processing._filter_upos(upos, lemma_set=lemma_set))
+
+    def reduce(self, file_path=None, n_jobs=4):
+        # merges lemma statistics, filters every shard with them and saves one table
+        self._check_shards()
+        self.lemma_stats = self.get_lemma_stats()
+        self.lemma_stats.to_parquet(os.path.join(self.work_dir, "lemma_stats.parquet"))
+        lemma_set = UposFilter(min_count=self.min_count, min_docs=self.min_docs)\
+            .get_lemma_set(self.lemma_stats)
+        print(f"Keeping {len(lemma_set)} of {len(self.lemma_stats)} lemmas.")
+        reconstructed = [r for r in Parallel(n_jobs=n_jobs)(delayed(self._reconstruct_shard)\
+            (k, lemma_set) for k in range(self.n_shards)) if len(r)>0]
+        if reconstructed:
+            reconstructed = pd.concat(reconstructed)
+        else:
+            # no document kept a lemma, the merge below leaves an empty table
+            reconstructed = pd.DataFrame({"reconstructed_text": pd.Series(dtype=object)},
+                index=pd.Index([], dtype="int64", name="doc_id"))
+        processing = DataProcessing(self.data_file, **self.processing_kwargs)
+        processing.data = pd.concat([pd.read_parquet(self._get_paths(k)["data"])
+            for k in range(self.n_shards)]).sort_index()
+        processing.data = processing.data.merge(reconstructed,
+            how="inner", left_index=True, right_index=True)
+        processing.get_metadata(**self.metadata_kwargs)
+        processing.save_data(file_path)
+        self.data = processing.data
+        return self
+
+    def get_config(self):
+        return {"n_shards": self.n_shards, "data_file": self.data_file,
+            "work_dir": self.work_dir, "processing_kwargs": self.processing_kwargs,
+            "preprocess_kwargs": self.preprocess_kwargs, "upos_kwargs": self.upos_kwargs,
+            "metadata_kwargs": self.metadata_kwargs, "min_count": self.min_count,
+            "min_docs": self.min_docs, "stream_filter": self.stream_filter}
+
+    def run_local(self, config_file=None, file_path=None, n_jobs=4):
+        # one process per shard stands in for the worker nodes, they get the settings
+        # of this instance, a config file given here is only passed on
+        if config_file is None:
+            os.makedirs(self.work_dir, exist_ok=True)
+            config_file = os.path.join(self.work_dir, "config.json")
+            self._write_json(config_file, self.get_config())
+        nodes = []
+        for k in range(self.n_shards):
+            args = [sys.executable, os.path.abspath(__file__), "--shard", str(k),
+                "--config", config_file]
+            nodes.append(subprocess.Popen(args))
+        failed = [k for k, node in enumerate(nodes) if node.wait() != 0]
+        if failed:
+            raise ValueError(f"Shards {failed} of {self.n_shards} failed.")
+        return self.reduce(file_path, n_jobs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DataProcessing over hashed shards.")
+    parser.add_argument("--config", default=None,
+        help="json file with the ShardedProcessing kwargs, the same on every node")
+    parser.add_argument("--shard", type=int, default=None, help="shard this node processes")
+    parser.add_argument("--reduce", action="store_true",
+        help="merge the processed shards into one table")
+    parser.add_argument("--local", action="store_true",
+        help="run every shard as a local process, then reduce")
+    parser.add_argument("--output", default=None, help="path of the processed table")
+    parser.add_argument("--n-jobs", type=int, default=4)
+    args = parser.parse_args()
+    config = {}
+    if args.config is not None:
+        with open(args.config, "r") as f:
+            config = json.load(f)
+    sharded = ShardedProcessing(**config)
+    if args.shard is not None:
+        sharded.run_shard(args.shard)
+    elif args.local:
+        sharded.run_local(args.config, args.output, args.n_jobs)
+    elif args.reduce:
+        sharded.reduce(args.output, args.n_jobs)
+
+# %%
+if __name__ == "__main__":
+    main()
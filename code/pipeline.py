@@ -0,0 +1,266 @@
+# %%
+### prepare
+import os
+import json
+import hashlib
+import argparse
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from ingestion import DataIngestion
+from processing import DataProcessing
+from instrumentation import Instrumentation
+
+# stage -> owner, method, required stages and the keyword that sets its worker count
+STAGES = {
+    "load": {"owner": "ingestion", "method": "load_data", "after": [], "workers": None},
+    "download": {"owner": "ingestion", "method": "download_reports", "after": ["load"],
+        "workers": "n_jobs"},
+    "convert": {"owner": "ingestion", "method": "convert_reports", "after": ["download"],
+        "workers": "n_workers"},
+    "read": {"owner": "ingestion", "method": "read_reports", "after": ["convert"],
+        "workers": "n_jobs"},
+    "ingested": {"owner": "ingestion", "method": "save_data", "after": ["read"],
+        "workers": None},
+    "handoff": {"owner": "processing", "method": None, "after": ["ingested"],
+        "workers": None},
+    "preprocess": {"owner": "processing", "method": "preprocess_reports",
+        "after": ["handoff"], "workers": "n_jobs"},
+    "upos": {"owner": "processing", "method": "construct_upos", "after": ["preprocess"],
+        "workers": "n_jobs"},
+    "metadata": {"owner": "processing", "method": "get_metadata", "after": ["upos"],
+        "workers": "n_jobs"},
+    "processed": {"owner": "processing", "method": "save_data", "after": ["metadata"],
+        "workers": None},
+}
+
+# batches are DataIngestion objects, only its per document stages can overlap
+OVERLAP_STAGES = ["download", "convert", "read"]
+
+# the worker counts that used to be hardcoded across the classes
+DEFAULT_CONFIG = {
+    "checkpoint_dir": "../data/checkpoints/",
+    "budget": {"cpus": os.cpu_count(), "memory_gb": 16},
+    "ingestion": {},
+    "processing": {},
+    "overlap": {"stages": [], "batch_size": 500},
+    "instrumentation": None,
+    "stages": {
+        "download": {"n_jobs": 5, "worker_memory_gb": 0.25},
+        "convert": {"n_jobs": 4, "worker_memory_gb": 1},
+        "read": {"n_jobs": 7, "worker_memory_gb": 1},
+        "preprocess": {"n_jobs": 8, "worker_memory_gb": 1},
+        "upos": {"n_jobs": 8, "worker_memory_gb": 2},
+        "metadata": {"n_jobs": 1, "worker_memory_gb": 1},
+    },
+}
+
+class Pipeline():
+
+    def __init__(self, config = None) -> None:
+        self.config = json.loads(json.dumps(DEFAULT_CONFIG))
+        for k, v in (config or {}).items():
+            if isinstance(v, dict) and k in ["budget", "overlap"]:
+                self.config[k].update(v)
+            elif k == "stages":
+                for stage, params in v.items():
+                    self.config["stages"][stage] = dict(
+                        self.config["stages"].get(stage, {}), **params)
+            else:
+                self.config[k] = v
+        unsupported = [s for s in self.config["overlap"]["stages"] if s not in OVERLAP_STAGES]
+        if unsupported:
+            raise ValueError(f"Stages {unsupported} cannot overlap, only {OVERLAP_STAGES} can.")
+        self.checkpoint_dir = self.config["checkpoint_dir"]
+        self.state_file = os.path.join(self.checkpoint_dir, "state.json")
+        # e.g. {"log_file": "../data/run_log.jsonl", "profile": true}
+        self.instrumentation = None
+        if self.config["instrumentation"] is not None:
+            self.instrumentation = Instrumentation(**self.config["instrumentation"])
+        self.ingestion = DataIngestion(**self.config["ingestion"],
+            instrumentation=self.instrumentation)
+        self.processing = DataProcessing(**self.config["processing"],
+            instrumentation=self.instrumentation)
+        pass
+
+    def get_order(self, stages=None):
+        # depth first topological order of the requested stages and their requirements
+        order, seen = [], set()
+        def visit(stage):
+            if stage in seen:
+                return
+            seen.add(stage)
+            for required in STAGES[stage]["after"]:
+                visit(required)
+            order.append(stage)
+        for stage in (stages or list(STAGES)):
+            visit(stage)
+        return order
+
+    def get_groups(self, stages=None):
+        # only neighbours in the order overlap, a stage in between keeps its place
+        overlap = self.config["overlap"]["stages"]
+        groups = []
+        for stage in self.get_order(stages):
+            if groups and stage in overlap and groups[-1][-1] in overlap:
+                groups[-1].append(stage)
+            else:
+                groups.append([stage])
+        return groups
+
+    def get_n_jobs(self, stage):
+        # the smallest of the requested workers, the cpu budget and the memory budget
+        params = self.config["stages"].get(stage, {})
+        budget = dict(self.config["budget"], **params.get("budget", {}))
+        n_jobs = params.get("n_jobs", 1)
+        if budget.get("cpus"):
+            n_jobs = min(n_jobs, budget["cpus"])
+        if budget.get("memory_gb") and params.get("worker_memory_gb"):
+            n_jobs = min(n_jobs, int(budget["memory_gb"]//params["worker_memory_gb"]))
+        return max(1, n_jobs)
+
+    def get_kwargs(self, stage):
+        kwargs = dict(self.config["stages"].get(stage, {}).get("kwargs", {}))
+        workers = STAGES[stage]["workers"]
+        # conversion only takes a worker count in pool mode
+        if workers == "n_workers" and kwargs.get("engine", "serial") != "pool":
+            workers = None
+        if workers is not None:
+            kwargs[workers] = self.get_n_jobs(stage)
+        return kwargs
+
+    def _get_frame(self, owner):
+        return self.ingestion.docs_data if owner == "ingestion" else self.processing.data
+
+    def _set_frame(self, owner, frame):
+        if owner == "ingestion":
+            self.ingestion.docs_data = frame
+        else:
+            self.processing.data = frame
+        return self
+
+    def _load_state(self):
+        if not os.path.exists(self.state_file):
+            return {"completed": [], "batches": []}
+        with open(self.state_file, "r") as f:
+            return json.load(f)
+
+    def _save_state(self):
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+        return self
+
+    def _get_checkpoint(self, name):
+        return os.path.join(self.checkpoint_dir, name + ".parquet")
+
+    def _checkpoint(self, stage):
+        owner = STAGES[stage]["owner"]
+        self._get_frame(owner).to_parquet(self._get_checkpoint(stage))
+        self.state["completed"].append(stage)
+        return self._save_state()
+
+    def _restore(self):
+        # every owner gets back its frame from its last completed stage
+        for owner in ["ingestion", "processing"]:
+            done = [s for s in self.state["completed"] if STAGES[s]["owner"] == owner]
+            if done:
+                self._set_frame(owner, pd.read_parquet(self._get_checkpoint(done[-1])))
+                print(f"Resumed {owner} from stage '{done[-1]}'.")
+        return self
+
+    def _run_stage(self, stage, target=None):
+        spec = STAGES[stage]
+        if stage == "handoff":
+            # same as DataProcessing.load_data on the ingested file, without reading it back
+            self.processing.data = self.ingestion.docs_data.copy()
+            return self
+        target = target or getattr(self, spec["owner"])
+        getattr(target, spec["method"])(**self.get_kwargs(stage))
+        return self
+
+    def _run_batch(self, stage, batch):
+        self._run_stage(stage, batch)
+        return batch
+
+    def _run_overlapped(self, stages):
+        # one thread per stage, so downloads, conversions and extraction of different
+        # batches run at the same time, each stage still uses its own worker pool
+        data = self.ingestion.docs_data
+        size = self.config["overlap"]["batch_size"]
+        batches = []
+        for i in range(0, len(data), size):
+            # named by stages and documents, checkpoints of another batch size never match
+            k = "batch_" + hashlib.md5(("-".join(stages) + ":" + ",".join(
+                map(str, data.index[i:i+size]))).encode("utf-8")).hexdigest()[:16]
+            path = self._get_checkpoint(k)
+            if k in self.state["batches"]:
+                batches.append(pd.read_parquet(path))
+                continue
+            batch = DataIngestion(**self.config["ingestion"],
+                instrumentation=self.instrumentation)
+            batch.docs_data = data.iloc[i:i+size].copy()
+            batches.append((k, path, batch))
+        executors = {s: ThreadPoolExecutor(max_workers=1) for s in stages}
+        futures = []
+        for item in batches:
+            if isinstance(item, pd.DataFrame):
+                continue
+            k, path, batch = item
+            future = None
+            for stage in stages:
+                if future is None:
+                    future = executors[stage].submit(self._run_batch, stage, batch)
+                else:
+                    future = executors[stage].submit(
+                        lambda s, f: self._run_batch(s, f.result()), stage, future)
+            futures.append((k, path, future))
+        frames = [b for b in batches if isinstance(b, pd.DataFrame)]
+        for k, path, future in futures:
+            frame = future.result().docs_data
+            frame.to_parquet(path)
+            self.state["batches"].append(k)
+            self._save_state()
+            frames.append(frame)
+        for executor in executors.values():
+            executor.shutdown()
+        self.ingestion.docs_data = pd.concat(frames).loc[data.index]
+        return self
+
+    def run(self, stages=None, resume=True):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.state = self._load_state() if resume else {"completed": [], "batches": []}
+        self._restore()
+        for group in self.get_groups(stages):
+            todo = [s for s in group if s not in self.state["completed"]]
+            if not todo:
+                continue
+            if len(group)>1 or group[0] in self.config["overlap"]["stages"]:
+                print(f"Running stages {todo} on overlapping batches.")
+                self._run_overlapped(todo)
+                for s in todo:
+                    self._checkpoint(s)
+                continue
+            print(f"Running stage '{todo[0]}'.")
+            self._run_stage(todo[0])
+            self._checkpoint(todo[0])
+        return self
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the report pipeline stage by stage.")
+    parser.add_argument("--config", default=None, help="json file with the pipeline config")
+    parser.add_argument("--stages", default=None,
+        help="comma separated stages to reach, e.g. read,processed")
+    parser.add_argument("--restart", action="store_true",
+        help="ignore checkpoints and start from the first stage")
+    args = parser.parse_args()
+    config = None
+    if args.config is not None:
+        with open(args.config, "r") as f:
+            config = json.load(f)
+    stages = None if args.stages is None else args.stages.split(",")
+    Pipeline(config).run(stages, resume=not args.restart)
+
+# %%
+if __name__ == "__main__":
+    main()
@@ -7,14 +7,38 @@ from joblib import Parallel, delayed
 import pycld2 as cld2
 import spacy
 import gc
+from manifest import ArtifactManifest
+from normalization import TextNormalizer
+from sharding import TextShardWriter
+from tagging import UposTagger
+from filtering import UposFilter
+from metadata import TextMetadata
+from corpus import CorpusStore, get_store
+from instrumentation import instrument
+
+# columns of the tagged tokens, an empty frame keeps them when nothing was tagged
+UPOS_DTYPES = {"doc_id": "int64", "text": object, "lemma": object, "pos": object,
+    "tag": object, "dep": object, "shape": object, "is_alpha": bool, "is_stopword": bool}
 
 class DataProcessing():
     
     def __init__(self,
                 data_file = "../data/ingested.parquet",
-                data_folder = "../data/") -> None:
+                data_folder = "../data/",
+                manifest_file = None,
+                instrumentation = None) -> None:
         self.data_file = data_file
         self.data_folder = data_folder
+        self.normalizer = TextNormalizer()
+        self.tagger = None
+        self.manifest = None
+        self.instrumentation = instrumentation
+        if manifest_file is not None:
+            self.manifest = ArtifactManifest(manifest_file)
+        if instrumentation is not None:
+            instrumentation.attach(self, ["load_data", "preprocess_reports", "construct_upos",
+                "get_metadata", "save_data"],
+                    ["_preprocess_row", "_save_upos_batch", "_metadata_row"])
         pass
 
     def load_data(self):
@@ -30,25 +54,53 @@ class DataProcessing():
         return text
 
     def _preprocess_text(self, text):
-        text = text.lower()
-        text = re.sub(r"<.*?>|</.*?>","", text)
-        text = re.sub(r"(s?)(f|ht)tp(s?)://\S+\b","", text)
-        text = re.sub(r"^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$","", text) #email
-        text = re.sub(r"\\-","", text)
-        text = re.sub("[^a-z '.,?!:]"," ", text)
-        text = re.sub(r"\b(\w+\s*)\1{1,}", " ", text) #dupli "\\1"
-        return re.sub(r" +"," ", text)
+        return self.normalizer.normalize(text)
     
+    def _get_txt_paths(self):
+        # reports read straight into a packed store never had a txt file
+        if "txt_file_destination" not in self.data.columns:
+            return [None]*len(self.data)
+        return [None if pd.isnull(p) else p for p in self.data.txt_file_destination]
+
+    def _get_corpus_dirs(self):
+        if "corpus_destination" not in self.data.columns:
+            return [None]*len(self.data)
+        return [None if pd.isnull(d) else d for d in self.data.corpus_destination]
+
     def _preprocess_row(self, ind):
         # preprocess
         row = self.data.loc[ind].copy()
         #row["raw_text"] = self._load_text(row["txt_file_destination"])
-        row["text"] = self._preprocess_text(
-            self._load_text(row["txt_file_destination"]))
+        if pd.notnull(row.get("corpus_destination")):
+            row["text"] = self.normalizer.normalize(get_store(row["corpus_destination"]).get(ind))
+            return row
+        row["text"] = self.normalizer.normalize_file(row["txt_file_destination"])
         return row
         
-    def preprocess_reports(self, n_jobs = 8):
-        self.data = self.data.loc[(self.data.txt_file_destination.notnull()),]
+    def _preprocess_stream(self, n_jobs=8, dir_name="../data/text_shards/", shard_bytes=2**28):
+        writer = instrument(self.instrumentation, TextShardWriter(dir_name, shard_bytes),
+            ["write", "_normalize"])
+        ids, paths = list(self.data.index), self._get_txt_paths()
+        corpus_dirs = self._get_corpus_dirs()
+        # several tasks per worker keep the pool busy, each task writes its own shards
+        size = max(1, -(-len(ids)//(n_jobs*4)))
+        results = Parallel(n_jobs = n_jobs)(delayed(writer.write)\
+            (i, ids[j:j+size], paths[j:j+size], corpus_dirs[j:j+size])
+                for i, j in enumerate(range(0, len(ids), size)))
+        shards = pd.DataFrame([r for rs in results for r in rs],
+            columns=["doc_id", "text_shard", "text_chars"]).set_index("doc_id")
+        self.data = self.data.drop(columns=shards.columns, errors="ignore")\
+            .merge(shards, how="left", left_index=True, right_index=True)
+        return self
+
+    def preprocess_reports(self, n_jobs = 8, stream = False, **stream_kwargs):
+        has_text = pd.Series(self._get_txt_paths(), index=self.data.index, dtype=object)\
+            .notnull()
+        if "corpus_destination" in self.data.columns:
+            has_text = has_text | self.data.corpus_destination.notnull()
+        self.data = self.data.loc[has_text,]
+        if stream:
+            return self._preprocess_stream(n_jobs, **stream_kwargs)
         rows_ls = Parallel(n_jobs = n_jobs)(delayed(self._preprocess_row)\
             (ind) for ind in self.data.index)
         self.data = pd.DataFrame(rows_ls)
@@ -69,6 +121,21 @@ class DataProcessing():
             #print("Processing batch: ", i)
             yield data.iloc[i:i+batch_size,:].copy()
 
+    def _get_text_shards(self, col="text"):
+        # streamed text lives in parquet shards, only rows still in data are read back
+        for path, ids in self.data.loc[self.data.text_shard.notnull(),]\
+                .groupby("text_shard").groups.items():
+            shard = pd.read_parquet(path, filters=[("doc_id", "in", list(ids))])\
+                .set_index("doc_id").rename(columns={"text": col})
+            yield shard.loc[shard[col]!="", [col]]
+
+    def _get_text_batches(self, col="text", batch_size=100):
+        if col in self.data.columns:
+            yield from self._get_batches(self.data, batch_size)
+            return
+        for shard in self._get_text_shards(col):
+            yield from self._get_batches(shard, batch_size)
+
     def _deconstruct_upos_batch(self, data, col="text", n_jobs=1):
         nlp = spacy.load("en_core_web_lg", disable=["ner", "parser"])
         nlp.max_length = 20000000
@@ -80,22 +147,70 @@ class DataProcessing():
             columns=["doc_id","text", "lemma", "pos", "tag",
                 "dep", "shape", "is_alpha", "is_stopword"])
 
-    def _deconstruct_save_upos_batch(self, data, dir_name, col="text", n_jobs=1):
-        batches = self._get_batches(data)
+    def _deconstruct_save_upos_batch(self, batches, dir_name, col="text", n_jobs=1):
+        # only the shards written here are read back, stale ones of an earlier run with
+        # more batches stay out of the lemma counts
+        sources = []
         for i, v in enumerate(batches):
-            upos = self._deconstruct_upos_batch(v, col, n_jobs)
-            upos.to_parquet(dir_name + str(i) + ".parquet")
-            del upos;gc.collect()
+            self._save_upos_batch(v, dir_name + str(i) + ".parquet", col, n_jobs)
+            sources.append((dir_name + str(i) + ".parquet", list(v.index)))
+        return sources
+
+    def _save_upos_batch(self, data, path, col="text", n_jobs=1):
+        if self.tagger is not None:
+            self.tagger.tag_to_parquet(data.index, data.loc[:,col].values, path)
+            return self
+        upos = self._deconstruct_upos_batch(data, col, n_jobs)
+        upos.to_parquet(path)
+        del upos;gc.collect()
         return self
     
-    def _filter_upos(self, upos):
+    def _get_upos_params(self, col):
+        if self.tagger is not None:
+            return {"model": self.tagger.model, "exclude": self.tagger.exclude,
+                "chunk_chars": self.tagger.chunk_chars, "spacy": spacy.__version__, "col": col}
+        return {"model": "en_core_web_lg", "disable": ["ner", "parser"],
+            "spacy": spacy.__version__, "col": col}
+
+    def _deconstruct_save_upos_incremental(self, batches, dir_name, col="text", n_jobs=1):
+        # documents are keyed by index and text, only new or changed ones are tagged,
+        # hash named shards get a folder of their own, batch numbered ones never mix in
+        params = self._get_upos_params(col)
+        dir_name = os.path.join(dir_name, "incremental/")
+        os.makedirs(dir_name, exist_ok=True)
+        shards, n_reused = [], 0
+        for data in batches:
+            keys = pd.Series([self.manifest.hash_text(str(ind)+"\x00"+text)
+                for ind, text in data.loc[:,col].items()], index=data.index)
+            found = pd.Series(self.manifest.lookup_many("upos", keys.values, params),
+                index=data.index, dtype=object)
+            todo = found.index[found.isnull()]
+            n_reused += len(data)-len(todo)
+            if len(todo)>0:
+                # the same documents tagged with other params get a shard of their own
+                path = dir_name + self.manifest.hash_text(self.manifest.hash_params(params)
+                    + "".join(keys[todo])) + ".parquet"
+                self._save_upos_batch(data.loc[todo,:], path, col, n_jobs)
+                self.manifest.record_many("upos", keys[todo].values, path, params)
+                found[todo] = path
+            shards.append(found)
+        print(f"Reused {n_reused} tagged documents.")
+        if not shards:
+            return pd.Series(dtype=object)
+        return pd.concat(shards)
+
+    def _filter_upos(self, upos, min_count=100, min_docs=50, lemma_set=None):
         # univariate filter
         upos = upos.loc[upos.pos.isin(["NOUN", "ADJ", "VERB"]),:] 
         upos = upos.loc[~upos.is_stopword,:]
         upos = upos.loc[(upos.lemma.str.len()>2) & (upos.lemma.str.len()<19),:]
+        # lemmas kept by statistics merged over all partitions
+        if lemma_set is not None:
+            return upos.loc[upos.lemma.isin(lemma_set),:]
         # multivariate filter
         lemma_stats = upos.groupby("lemma", as_index=False).agg({"doc_id":["count", "nunique"]})
-        pf = (lemma_stats[("doc_id","count")]>100)&(lemma_stats[("doc_id","nunique")]>50) #500,250
+        pf = (lemma_stats[("doc_id","count")]>min_count)\
+            &(lemma_stats[("doc_id","nunique")]>min_docs) #500,250
         stopword_set = set([])
         lemma_set = set(lemma_stats.loc[pf,"lemma"].values).difference(stopword_set)
         return upos.loc[upos.lemma.isin(lemma_set),:]
@@ -109,44 +224,116 @@ class DataProcessing():
             lambda x: re.sub(r'\b(\w+\s*)\1{1,}', '\\1', x))  
         return reconstructed
 
-    def construct_upos(self, n_jobs=8, dir_name="../data/upos_files/", col="text"):
-        self.data = self.data.loc[(self.data.loc[:,col].notnull())\
-            & (~self.data.loc[:,col].isin([""])),]
+    def _tag_upos(self, n_jobs=8, dir_name="../data/upos_files/", col="text",
+            engine="legacy", batch_size=100, **engine_kwargs):
+        self.tagger = None
+        if engine == "arrow":
+            self.tagger = instrument(self.instrumentation,
+                UposTagger(n_jobs=n_jobs, **engine_kwargs), ["_tag"])
+        if col in self.data.columns:
+            self.data = self.data.loc[(self.data.loc[:,col].notnull())\
+                & (~self.data.loc[:,col].isin([""])),]
+        else:
+            self.data = self.data.loc[self.data.text_chars>0,]
+        batches = self._get_text_batches(col, batch_size)
+        if self.manifest is not None:
+            # deconstruct only new or changed documents, current shards are read back
+            shards = self._deconstruct_save_upos_incremental(batches, dir_name, col, n_jobs)
+            return [(path, list(ids.index)) for path, ids in shards.groupby(shards)]
         # deconstruct in parallel and save
-        #NOTE: THIS HAS TO BE UNCOMMENTED IF THE UPOS FILES ARE NOT YET CREATED
-        self._deconstruct_save_upos_batch(self.data, dir_name, col, n_jobs)
-        # load back
-        upos = pd.concat(self._get_parquet_files(dir_name)) 
-        # filter
-        upos = self._filter_upos(upos)
-        # reconstruct text and merge back
-        self.data = self.data.merge(self._reconstruct_upos(upos),
+        return self._deconstruct_save_upos_batch(batches, dir_name, col, n_jobs)
+
+    def _read_upos(self, sources):
+        # shards without documents are skipped, none at all leave an empty frame
+        frames = [pd.read_parquet(path, filters=[("doc_id", "in", list(ids))])
+            for path, ids in sources if len(ids)>0]
+        if not frames:
+            return pd.DataFrame({c: pd.Series(dtype=t) for c, t in UPOS_DTYPES.items()})
+        return pd.concat(frames)
+
+    def construct_upos(self, n_jobs=8, dir_name="../data/upos_files/", col="text",
+            engine="legacy", batch_size=100, stream_filter=False,
+            min_count=100, min_docs=50, **engine_kwargs):
+        sources = self._tag_upos(n_jobs, dir_name, col, engine, batch_size, **engine_kwargs)
+        upos_filter = UposFilter(min_count=min_count, min_docs=min_docs)
+        if stream_filter:
+            # two passes over the shards, lemma statistics first, then the texts
+            reconstructed = upos_filter.run(sources)
+        else:
+            # load back, filter and reconstruct in memory
+            upos = self._read_upos(sources)
+            upos = self._filter_upos(upos, min_count, min_docs)
+            reconstructed = self._reconstruct_upos(upos)
+        # merge back
+        self.data = self.data.merge(reconstructed,
             how="inner", left_index=True, right_index=True)   
         return self
     
+    def _metadata_text(self, text):
+        lang_estimation = cld2.detect(text, returnVectors=True)[2]
+        return {"n_chars": len(text),
+            "n_words": len(re.split("\w+",text)),
+            "n_sentences": len(re.split(r"[.?!]", text)),
+            "language": lang_estimation[0][1],
+            "language_score": lang_estimation[0][2]/100.0}
+
     def _metadata_row(self, ind, col = "reconstructed_text"):
         row = self.data.loc[ind].copy()
-        row["n_chars"] = len(row[col])
-        row["n_words"] = len(re.split("\w+",row[col]))
-        row["n_sentences"] = len(re.split(r"[.?!]", row[col]))
-
-        lang_estimation = cld2.detect(row[col], returnVectors=True)[2]
-        row["language"] = lang_estimation[0][1]
-        row["language_score"] = lang_estimation[0][2]/100.0
+        for k, v in self._metadata_text(row[col]).items():
+            row[k] = v
         return row    
+
+    def _metadata_stream(self, col="text", engine="legacy", **engine_kwargs):
+        # text is read back shard by shard, only the metadata columns are kept
+        self.data = self.data.loc[self.data.text_chars>0,]
+        if engine == "batched":
+            sources = self.data.loc[self.data.text_shard.notnull(),]\
+                .groupby("text_shard").groups.items()
+            metadata = instrument(self.instrumentation, TextMetadata(**engine_kwargs),
+                ["_describe"]).describe_shards(sources)
+        else:
+            metadata = pd.DataFrame.from_dict({ind: self._metadata_text(text)
+                for shard in self._get_text_shards(col) for ind, text in shard[col].items()},
+                    orient="index")
+        self.data = self.data.drop(columns=metadata.columns, errors="ignore")\
+            .merge(metadata, how="inner", left_index=True, right_index=True)
+        return self
     
-    def get_metadata(self, col="reconstructed_text", n_jobs=1):
+    def get_metadata(self, col="reconstructed_text", n_jobs=1, engine="legacy", **engine_kwargs):
+        if col not in self.data.columns:
+            return self._metadata_stream(col, engine, n_jobs=n_jobs, **engine_kwargs)
         self.data = self.data.loc[(self.data.loc[:,col].notnull())\
             & (~self.data.loc[:,col].isin([""])),]
+        if engine == "batched":
+            # workers return only the new columns, the rows stay in this process
+            metadata = instrument(self.instrumentation, TextMetadata(n_jobs=n_jobs,
+                **engine_kwargs), ["_describe"]).describe(self.data.index,
+                    self.data.loc[:,col].values)
+            self.data = self.data.drop(columns=metadata.columns, errors="ignore")\
+                .merge(metadata, how="left", left_index=True, right_index=True)
+            return self
         rows_ls = Parallel(n_jobs=n_jobs)(delayed(self._metadata_row)\
             (ind, col) for ind in self.data.index)
+        if not rows_ls:
+            # nothing to describe, the columns are kept for an empty table
+            self.data = self.data.reindex(columns=list(self.data.columns)+["n_chars",
+                "n_words", "n_sentences", "language", "language_score"])
+            return self
         self.data = pd.DataFrame(rows_ls)
         return self
     
-    def save_data(self, file_path = None):
+    def save_data(self, file_path = None, corpus_dir = None):
         if file_path is None:
             file_path = self.data_folder+"processed.parquet"
-        self.data.to_parquet(file_path)
+        data = self.data
+        if corpus_dir is not None:
+            # text columns go to packed stores next to the table, one per column, texts
+            # saved by an earlier call are not appended again
+            columns = [c for c in ["text", "reconstructed_text"] if c in data.columns]
+            for col in columns:
+                CorpusStore(os.path.join(corpus_dir, col)).update(data.index, data[col])
+            data = data.drop(columns=columns)
+        data.to_parquet(file_path)
         return self    
 
 # %%
@@ -0,0 +1,69 @@
+# %%
+### prepare
+import os
+import threading
+import pandas as pd
+import magic
+from concurrent.futures import ThreadPoolExecutor
+
+class FileScanner():
+
+    def __init__(self,
+                n_threads = 16,
+                header_size = 2**16,
+                cache_file = "../data/file_metadata.parquet") -> None:
+        self.n_threads = n_threads
+        self.header_size = header_size
+        self.cache_file = cache_file
+        self._local = threading.local()
+        pass
+
+    def _walk(self, dir_name):
+        for entry in os.scandir(dir_name):
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                yield os.path.normpath(entry.path), stat.st_size, stat.st_mtime
+
+    def _load_cache(self):
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return pd.DataFrame(columns=["path", "size", "mtime", "mime"]).set_index("path")
+        return pd.read_parquet(self.cache_file).set_index("path")
+
+    def _get_magic(self):
+        # libmagic handles are not thread safe, each thread opens its own once
+        if getattr(self._local, "magic", None) is None:
+            self._local.magic = magic.Magic(mime=True)
+        return self._local.magic
+
+    def _sniff(self, path, size):
+        if size == 0:
+            return "inode/x-empty"
+        try:
+            with open(path, "rb") as f:
+                header = f.read(self.header_size)
+            return self._get_magic().from_buffer(header)
+        except OSError as e:
+            print(f"Error probing '{path}': {e}.")
+            return None
+
+    def scan(self, dir_name):
+        files = pd.DataFrame(self._walk(dir_name), columns=["path", "size", "mtime"])\
+            .set_index("path")
+        cache = self._load_cache()
+        files = files.join(cache.loc[:, ["size", "mtime", "mime"]]\
+            .rename(columns=lambda c: "cached_"+c))
+        unchanged = (files["size"]==files["cached_size"])\
+            & (files["mtime"]==files["cached_mtime"]) & files["cached_mime"].notnull()
+        files["mime"] = files["cached_mime"].where(unchanged)
+        todo = files.index[~unchanged]
+        with ThreadPoolExecutor(max_workers=self.n_threads) as pool:
+            files.loc[todo, "mime"] = list(pool.map(self._sniff, todo,
+                files.loc[todo, "size"]))
+        files = files.loc[:, ["size", "mtime", "mime"]]
+        if self.cache_file is not None and len(todo)>0:
+            pd.concat([cache.loc[~cache.index.isin(files.index), ["size", "mtime", "mime"]],
+                files]).rename_axis("path").reset_index().to_parquet(self.cache_file)
+        print(f"Scanned {len(files)} files, probed {len(todo)}.")
+        return files
@@ -0,0 +1,51 @@
+# %%
+### prepare
+import os
+import pandas as pd
+from normalization import TextNormalizer
+from corpus import get_store
+
+class TextShardWriter():
+
+    def __init__(self,
+                dir_name = "../data/text_shards/",
+                shard_bytes = 2**28) -> None:
+        self.dir_name = dir_name
+        self.shard_bytes = shard_bytes
+        self.normalizer = TextNormalizer()
+        pass
+
+    def _flush(self, buffer, task_id, shard_no):
+        path = os.path.join(self.dir_name, f"{task_id}_{shard_no}.parquet")
+        pd.DataFrame(buffer, columns=["doc_id", "text"]).to_parquet(path)
+        return path
+
+    def _normalize(self, ind, path, corpus_dir=None):
+        if corpus_dir is not None:
+            return self.normalizer.normalize(get_store(corpus_dir).get(ind))
+        return self.normalizer.normalize_file(path)
+
+    def write(self, task_id, ids, paths, corpus_dirs=None):
+        # normalized text never leaves the worker, only ids and shard paths do
+        os.makedirs(self.dir_name, exist_ok=True)
+        if corpus_dirs is None:
+            corpus_dirs = [None]*len(ids)
+        results, buffer, pending, size, shard_no = [], [], [], 0, 0
+        for ind, path, corpus_dir in zip(ids, paths, corpus_dirs):
+            try:
+                text = self._normalize(ind, path, corpus_dir)
+            except Exception as e:
+                print(f"Error preprocessing '{path}': {e}.")
+                results.append((ind, None, 0))
+                continue
+            buffer.append((ind, text))
+            pending.append((ind, len(text)))
+            size += len(text)
+            if size >= self.shard_bytes:
+                shard = self._flush(buffer, task_id, shard_no)
+                results += [(i, shard, n) for i, n in pending]
+                buffer, pending, size, shard_no = [], [], 0, shard_no+1
+        if buffer:
+            shard = self._flush(buffer, task_id, shard_no)
+            results += [(i, shard, n) for i, n in pending]
+        return results
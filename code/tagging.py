@@ -0,0 +1,95 @@
+# %%
+### prepare
+import re
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import spacy
+from spacy.attrs import ORTH, LEMMA, POS, TAG, DEP, SHAPE, IS_ALPHA, IS_STOP
+from joblib import Parallel, delayed
+
+# one pipeline per worker process, reused by every batch the worker receives
+_MODELS = {}
+
+class UposTagger():
+
+    ATTRS = [ORTH, LEMMA, POS, TAG, DEP, SHAPE, IS_ALPHA, IS_STOP]
+    STRING_COLUMNS = ["text", "lemma", "pos", "tag", "dep", "shape"]
+
+    def __init__(self,
+                model = "en_core_web_lg",
+                exclude = ("parser", "ner", "senter"),
+                n_jobs = 8,
+                chunk_chars = 100000,
+                batch_size = 64) -> None:
+        self.model = model
+        self.exclude = list(exclude)
+        self.n_jobs = n_jobs
+        self.chunk_chars = chunk_chars
+        self.batch_size = batch_size
+        pass
+
+    def _get_nlp(self):
+        key = (self.model, tuple(self.exclude))
+        if key not in _MODELS:
+            _MODELS[key] = spacy.load(self.model, exclude=self.exclude)
+        return _MODELS[key]
+
+    def _split_text(self, text):
+        # sentence sized chunks keep every doc below the default nlp.max_length
+        chunks, start = [], 0
+        while len(text)-start > self.chunk_chars:
+            window = text[start:start+self.chunk_chars]
+            ends = [m.end() for m in re.finditer(r"[.?!] ", window)]
+            cut = ends[-1] if ends else window.rfind(" ")+1
+            if cut <= 0:
+                cut = self.chunk_chars
+            chunks.append(text[start:start+cut])
+            start += cut
+        chunks.append(text[start:])
+        return chunks
+
+    def _encode(self, values, strings):
+        # dictionary columns, each distinct hash is resolved to a string once
+        uniques, indices = np.unique(values, return_inverse=True)
+        dictionary = pa.array([strings[int(h)] for h in uniques], pa.string())
+        return pa.DictionaryArray.from_arrays(pa.array(indices.astype(np.int32)), dictionary)
+
+    def _tag(self, ids, texts):
+        nlp = self._get_nlp()
+        chunk_ids, chunks = [], []
+        for ind, text in zip(ids, texts):
+            for chunk in self._split_text(text):
+                chunk_ids.append(ind)
+                chunks.append(chunk)
+        arrays, doc_ids = [], []
+        for ind, doc in zip(chunk_ids, nlp.pipe(chunks, batch_size=self.batch_size)):
+            arrays.append(doc.to_array(self.ATTRS))
+            doc_ids.append(np.full(len(doc), ind, dtype=np.int64))
+        if not arrays:
+            return self._empty()
+        values = np.concatenate(arrays)
+        columns = [pa.array(np.concatenate(doc_ids))]
+        columns += [self._encode(values[:,i], nlp.vocab.strings)
+            for i in range(len(self.STRING_COLUMNS))]
+        columns += [pa.array(values[:,i].astype(bool)) for i in (6, 7)]
+        return pa.Table.from_arrays(columns, names=["doc_id"] + self.STRING_COLUMNS\
+            + ["is_alpha", "is_stopword"])
+
+    def _empty(self):
+        schema = pa.schema([("doc_id", pa.int64())]\
+            + [(c, pa.dictionary(pa.int32(), pa.string())) for c in self.STRING_COLUMNS]\
+            + [("is_alpha", pa.bool_()), ("is_stopword", pa.bool_())])
+        return schema.empty_table()
+
+    def tag(self, ids, texts):
+        ids, texts = list(ids), list(texts)
+        size = max(1, -(-len(ids)//self.n_jobs))
+        tables = Parallel(n_jobs=self.n_jobs)(delayed(self._tag)\
+            (ids[i:i+size], texts[i:i+size]) for i in range(0, len(ids), size))
+        return pa.concat_tables(tables or [self._empty()]).unify_dictionaries()
+
+    def tag_to_parquet(self, ids, texts, path):
+        table = self.tag(ids, texts)
+        pq.write_table(table, path)
+        return table.num_rows
@@ -0,0 +1,147 @@
+# %%
+### prepare
+import os
+import time
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from joblib import Parallel, delayed
+from sklearn.decomposition import LatentDirichletAllocation
+
+class LdaSweep():
+
+    def __init__(self,
+                n_topics = (5, 10, 15, 20, 25),
+                seeds = (0,),
+                n_jobs = 4,
+                max_iter = 10,
+                stream = False,
+                batch_size = 128,
+                eval_docs = 5000,
+                top_n = 10,
+                holdout = 0.1,
+                model_dir = "../data/lda_models/") -> None:
+        self.n_topics = list(n_topics)
+        self.seeds = list(seeds)
+        self.n_jobs = n_jobs
+        self.max_iter = max_iter
+        self.stream = stream
+        self.batch_size = batch_size
+        self.eval_docs = eval_docs
+        self.top_n = top_n
+        self.holdout = holdout
+        self.model_dir = model_dir
+        pass
+
+    def _get_dtm_paths(self):
+        path = os.path.join(self.model_dir, "dtm_")
+        return {k: path + k + ".npy" for k in ["data", "indices", "indptr", "shape"]}
+
+    def save_dtm(self, dtm, order=None, block_rows=10000):
+        # the csr buffers are written once, every worker maps the same files, rows are
+        # reordered block by block into the mapped files, no second full copy is built
+        os.makedirs(self.model_dir, exist_ok=True)
+        dtm = sp.csr_matrix(dtm)
+        if order is None:
+            order = np.arange(dtm.shape[0])
+        indptr = np.zeros(dtm.shape[0]+1, dtype=dtm.indptr.dtype)
+        np.cumsum(np.diff(dtm.indptr)[order], out=indptr[1:])
+        paths, nnz = self._get_dtm_paths(), int(indptr[-1])
+        data = np.lib.format.open_memmap(paths["data"], mode="w+", dtype=np.float64,
+            shape=(nnz,))
+        indices = np.lib.format.open_memmap(paths["indices"], mode="w+",
+            dtype=dtm.indices.dtype, shape=(nnz,))
+        for i in range(0, dtm.shape[0], block_rows):
+            block = dtm[order[i:i+block_rows]]
+            start, stop = indptr[i], indptr[min(i+block_rows, dtm.shape[0])]
+            data[start:stop], indices[start:stop] = block.data, block.indices
+        data.flush()
+        indices.flush()
+        del data, indices
+        np.save(paths["indptr"], indptr)
+        np.save(paths["shape"], np.array(dtm.shape))
+        return self
+
+    def load_dtm(self):
+        # copy-on-write, input validation may write to the index arrays
+        paths = self._get_dtm_paths()
+        arrays = [np.load(paths[k], mmap_mode="c") for k in ["data", "indices", "indptr"]]
+        return sp.csr_matrix(tuple(arrays), shape=tuple(np.load(paths["shape"])), copy=False)
+
+    def _get_rows(self, dtm, start, stop):
+        # a row range of the mapped matrix built on views, nothing is copied
+        indptr = dtm.indptr[start:stop+1]
+        return sp.csr_matrix((dtm.data[indptr[0]:indptr[-1]],
+            dtm.indices[indptr[0]:indptr[-1]], indptr-indptr[0]),
+                shape=(stop-start, dtm.shape[1]), copy=False)
+
+    def _get_model(self, n_topics, seed, n_docs):
+        return LatentDirichletAllocation(n_components=n_topics, max_iter=self.max_iter,
+            learning_method="online", learning_offset=50., random_state=seed,
+                total_samples=n_docs, batch_size=self.batch_size)
+
+    def _fit_stream(self, lda, dtm):
+        # minibatches are row slices of the mapped matrix, only their pages are read
+        for _ in range(self.max_iter):
+            for i in range(0, dtm.shape[0], self.batch_size):
+                lda.partial_fit(dtm[i:i+self.batch_size])
+        return lda
+
+    def _get_coherence(self, lda, dtm):
+        # umass coherence of each topic's top words, from document co-occurrence
+        top = np.argsort(-lda.components_, axis=1)[:,:self.top_n]
+        words = np.unique(top)
+        binary = (dtm[:,words] > 0).astype(np.float64)
+        cooc = np.asarray((binary.T @ binary).todense())
+        pos = np.searchsorted(words, top)
+        scores = []
+        for topic in pos:
+            pairs = [(topic[i], topic[j]) for i in range(1, len(topic)) for j in range(i)]
+            scores.append(np.mean([np.log((cooc[a, b]+1)/cooc[b, b]) for a, b in pairs]))
+        return float(np.mean(scores))
+
+    def _get_n_train(self, n_docs):
+        # rows were shuffled when saved, the tail is held out for perplexity
+        n_test = int(n_docs*self.holdout)
+        return n_docs-n_test if n_test>0 else n_docs
+
+    def _fit(self, n_topics, seed):
+        dtm = self.load_dtm()
+        n_train = self._get_n_train(dtm.shape[0])
+        train = self._get_rows(dtm, 0, n_train)
+        test = train if n_train==dtm.shape[0] else self._get_rows(dtm, n_train, dtm.shape[0])
+        start = time.perf_counter()
+        lda = self._get_model(n_topics, seed, n_train)
+        if self.stream:
+            self._fit_stream(lda, train)
+        else:
+            lda.fit(train)
+        wall_time = time.perf_counter()-start
+        path = os.path.join(self.model_dir, f"lda_{n_topics}_{seed}.joblib")
+        joblib.dump(lda, path)
+        return {"n_topics": n_topics, "seed": seed,
+            "perplexity": lda.perplexity(test[:self.eval_docs]),
+                "heldout": test is not train, "coherence": self._get_coherence(lda, train),
+                    "wall_time": wall_time, "model_path": path}
+
+    def run(self, dtm, tokens=None):
+        # one fixed shuffle, every model of the grid sees the same held out documents,
+        # the caller's matrix still has to fit in memory, the sweep only adds one block
+        # of rows on top of it, workers read the shuffled copy from disk
+        order = np.random.default_rng(0).permutation(dtm.shape[0])
+        self.save_dtm(dtm, order)
+        if tokens is not None:
+            np.save(os.path.join(self.model_dir, "tokens.npy"), np.asarray(tokens).astype(str))
+        grid = [(k, s) for k in self.n_topics for s in self.seeds]
+        rows = Parallel(n_jobs=self.n_jobs)(delayed(self._fit)(k, s) for k, s in grid)
+        self.results = pd.DataFrame(rows)
+        self.results.to_csv(os.path.join(self.model_dir, "results.csv"), index=False)
+        return self.results
+
+    def load_results(self):
+        # the grid of an earlier session, models and tokens are read from model_dir
+        self.results = pd.read_csv(os.path.join(self.model_dir, "results.csv"))
+        tokens_path = os.path.join(self.model_dir, "tokens.npy")
+        self.tokens = np.load(tokens_path) if os.path.exists(tokens_path) else None
+        return self.results
@@ -0,0 +1,65 @@
+# %%
+### prepare
+import os
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from manifest import ArtifactManifest
+
+class VectorCache():
+
+    def __init__(self,
+                data_path = "../data/processed.parquet",
+                cache_dir = "../data/vector_cache/") -> None:
+        self.data_path = data_path
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.manifest = ArtifactManifest(os.path.join(cache_dir, "manifest.sqlite"))
+        self.matrices = {}
+        pass
+
+    def _get_key(self, texts, ngram_range, max_features):
+        # the data file hash is cached by size and mtime, rows and params complete the key,
+        # texts read from a packed store add its index, which changes on every append
+        store = getattr(texts, "store", None)
+        return self.manifest.hash_params({"data": self.manifest.hash_file(self.data_path),
+            "corpus": None if store is None else self.manifest.hash_file(store.index_path),
+            "rows": self.manifest.hash_text(",".join(map(str, texts.index))),
+            "column": texts.name, "ngram_range": list(ngram_range),
+            "max_features": max_features})
+
+    def _get_paths(self, key):
+        path = os.path.join(self.cache_dir, key)
+        return path + ".npz", path + ".tokens.npy"
+
+    def _load(self, key):
+        matrix_path, tokens_path = self._get_paths(key)
+        if not (os.path.exists(matrix_path) and os.path.exists(tokens_path)):
+            return None
+        return sp.load_npz(matrix_path).tocsr(), np.load(tokens_path)
+
+    def _save(self, key, counts, tokens):
+        matrix_path, tokens_path = self._get_paths(key)
+        sp.save_npz(matrix_path, counts, compressed=False)
+        np.save(tokens_path, tokens.astype(str))
+        return self
+
+    def get_counts(self, texts, ngram_range=(1,1), max_features=10000):
+        # the corpus is tokenized once per params, later calls read the csr matrix back
+        key = self._get_key(texts, ngram_range, max_features)
+        if key not in self.matrices:
+            cached = self._load(key)
+            if cached is None:
+                cv = CountVectorizer(ngram_range=ngram_range, max_features=max_features)
+                cached = cv.fit_transform(texts).tocsr(), cv.get_feature_names_out()
+                self._save(key, *cached)
+            self.matrices[key] = cached
+        return self.matrices[key]
+
+    def get_tfidf(self, texts, ngram_range=(1,1), max_features=10000):
+        # same weights as TfidfVectorizer, which is a count vectorizer plus this transform
+        counts, tokens = self.get_counts(texts, ngram_range, max_features)
+        return TfidfTransformer().fit_transform(counts), tokens
+
+    def get_analyzer(self, ngram_range=(1,1)):
+        return CountVectorizer(ngram_range=ngram_range).build_analyzer()
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+# the modules live flat in code/ and are imported by name, as the scripts do
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "code"))
+
+@pytest.fixture(scope="session")
+def upos_model(tmp_path_factory):
+    # a small pipeline saved to disk, every word a noun, a few lemmas looked up
+    spacy = pytest.importorskip("spacy")
+    from spacy.lookups import Lookups
+    nlp = spacy.blank("en")
+    nlp.add_pipe("attribute_ruler").add([[{"IS_ALPHA": True}]], {"POS": "NOUN"})
+    lookups = Lookups()
+    lookups.add_table("lemma_lookup", {"reports": "report", "emissions": "emission",
+        "employees": "employee", "trained": "train", "fell": "fall"})
+    nlp.add_pipe("lemmatizer", config={"mode": "lookup"}).initialize(lookups=lookups)
+    path = tmp_path_factory.mktemp("model") / "upos_model"
+    nlp.to_disk(path)
+    return str(path)
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import stat
+import pytest
+from conversion import ConversionPool
+
+# stands in for soffice, converts its arguments in order into empty pdfs
+STUB = """#!{python}
+import os, sys, time
+args = sys.argv[1:]
+outdir = args[args.index("--outdir")+1]
+files = args[args.index("--outdir")+2:]
+for path in files:
+    name = os.path.splitext(os.path.basename(path))[0]
+    if "hang" in name:
+        with open(os.path.join(outdir, "hang.pid"), "w") as f:
+            f.write(str(os.getpid()))
+        time.sleep(60)
+    if "fail" in name:
+        continue
+    time.sleep(0.3)
+    with open(os.path.join(outdir, name + ".pdf"), "w") as f:
+        f.write("%PDF-1.4")
+"""
+
+@pytest.fixture
+def converter(tmp_path):
+    path = tmp_path / "soffice"
+    path.write_text(STUB.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+@pytest.fixture
+def docs(tmp_path):
+    def make(*names):
+        paths = []
+        for name in names:
+            path = tmp_path / "raw" / (name + ".docx")
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(name)
+            paths.append(str(path))
+        return paths
+    return make
+
+def convert(pool, files, out_dir):
+    out_dir.mkdir(exist_ok=True)
+    results = pool.convert(files, [str(out_dir)]*len(files))
+    return {os.path.basename(r["file_destination"]): r for r in results}
+
+def test_converts_and_times_every_file(converter, docs, tmp_path):
+    pool = ConversionPool(n_workers=1, converter=converter, batch_size=3, timeout=10)
+    results = convert(pool, docs("a", "b", "c"), tmp_path / "out")
+    assert {r["conversion_status"] for r in results.values()} == {"converted"}
+    for r in results.values():
+        assert os.path.exists(r["converted_file_destination"])
+        # per file, not the batch time divided by its size
+        assert 0.2 < r["conversion_time"] < 2
+
+def test_failed_file_is_reported(converter, docs, tmp_path):
+    pool = ConversionPool(n_workers=1, converter=converter, batch_size=2, timeout=10)
+    results = convert(pool, docs("a", "fail"), tmp_path / "out")
+    assert results["a.docx"]["conversion_status"] == "converted"
+    assert results["fail.docx"]["conversion_status"] == "failed"
+    assert results["fail.docx"]["converted_file_destination"] is None
+
+def test_hung_file_is_killed_and_the_rest_retried(converter, docs, tmp_path):
+    pool = ConversionPool(n_workers=1, converter=converter, batch_size=4, timeout=1)
+    start = time.time()
+    results = convert(pool, docs("a", "hang", "b", "c"), tmp_path / "out")
+    elapsed = time.time()-start
+    assert results["hang.docx"]["conversion_status"] == "timeout"
+    for name in ["a.docx", "b.docx", "c.docx"]:
+        assert results[name]["conversion_status"] == "converted"
+    # one timeout for the batch and one for the retry, not one per file in the batch
+    assert elapsed < 6
+    with open(tmp_path / "out" / "hang.pid") as f:
+        pid = int(f.read())
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
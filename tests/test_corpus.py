@@ -0,0 +1,98 @@
+import os
+import multiprocessing
+import pandas as pd
+from corpus import CorpusStore, get_store
+from ingestion import DataIngestion
+from processing import DataProcessing
+
+def test_save_data_appends_only_changed_texts(tmp_path):
+    corpus_dir = str(tmp_path / "corpus")
+    data_path = os.path.join(corpus_dir, "text", "texts.bin")
+    processing = DataProcessing(data_folder=str(tmp_path) + "/")
+    processing.data = pd.DataFrame({"name": ["a", "b", "c"],
+        "text": ["water report", "energy use", "héllo"]}, index=[1, 2, 3])
+    processing.save_data(corpus_dir=corpus_dir)
+    size = os.path.getsize(data_path)
+    processing.save_data(corpus_dir=corpus_dir)
+    assert os.path.getsize(data_path) == size
+    processing.data.loc[2, "text"] = "energy use fell"
+    processing.save_data(corpus_dir=corpus_dir)
+    assert os.path.getsize(data_path) == size + len("energy use fell")
+    store = CorpusStore(os.path.join(corpus_dir, "text"))
+    assert [store.get(i) for i in [1, 2, 3]] == ["water report", "energy use fell", "héllo"]
+    assert "text" not in pd.read_parquet(tmp_path / "processed.parquet").columns
+
+def test_round_trip(tmp_path):
+    store = CorpusStore(str(tmp_path))
+    store.append(5, "first report")
+    store.extend([7, 9], ["second, ünïcode", ""], batch_size=1)
+    assert [store.get(i) for i in [5, 7, 9]] == ["first report", "second, ünïcode", ""]
+    # the last record of a document wins, for this store and a new one
+    store.append(5, "first report, revised")
+    for s in [store, CorpusStore(str(tmp_path))]:
+        assert sorted(s.ids()) == [5, 7, 9]
+        assert s.get(5) == "first report, revised"
+        assert dict(s.iter_texts([5, 9])) == {5: "first report, revised", 9: ""}
+
+def _read_twice(dir_name, ready, appended, queue):
+    # a worker keeps its store cached between tasks
+    store = get_store(dir_name)
+    queue.put(store.get(1))
+    ready.set()
+    appended.wait(10)
+    queue.put((store.get(1), store.get(2)))
+
+def test_cached_store_sees_appends_of_other_process(tmp_path):
+    context = multiprocessing.get_context("fork")
+    CorpusStore(str(tmp_path)).append(1, "old text")
+    ready, appended, queue = context.Event(), context.Event(), context.Queue()
+    reader = context.Process(target=_read_twice, args=(str(tmp_path), ready, appended, queue))
+    reader.start()
+    assert ready.wait(10)
+    CorpusStore(str(tmp_path)).extend([1, 2], ["new text", "other text"])
+    appended.set()
+    assert queue.get(timeout=10) == "old text"
+    assert queue.get(timeout=10) == ("new text", "other text")
+    reader.join(10)
+    assert reader.exitcode == 0
+
+def _append_many(dir_name, start):
+    store = CorpusStore(dir_name)
+    for i in range(start, start+50):
+        store.append(i, f"document {i} " * (i % 7 + 1))
+
+def test_concurrent_appends(tmp_path):
+    context = multiprocessing.get_context("fork")
+    writers = [context.Process(target=_append_many, args=(str(tmp_path), k*50))
+        for k in range(4)]
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join(30)
+    store = CorpusStore(str(tmp_path))
+    assert sorted(store.ids()) == list(range(200))
+    assert all(store.get(i) == f"document {i} " * (i % 7 + 1) for i in range(200))
+
+def test_pack_reports_repacks_changed_files(tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"cop_{i}.txt"))
+        with open(paths[-1], "w") as f:
+            f.write(f"report {i}")
+    corpus_dir = str(tmp_path / "corpus") + "/"
+    ingestion = DataIngestion(data_folder=str(tmp_path) + "/")
+    ingestion.docs_data = pd.DataFrame({"txt_file_destination": paths}, index=[0, 1, 2])
+    ingestion.pack_reports(corpus_dir)
+    store = CorpusStore(corpus_dir)
+    assert all(store.is_current(i, p) for i, p in enumerate(paths))
+    size = os.path.getsize(store.data_path)
+    # unchanged files are skipped, a rewritten one is packed again
+    ingestion.pack_reports(corpus_dir)
+    assert os.path.getsize(store.data_path) == size
+    with open(paths[1], "w") as f:
+        f.write("report 1, corrected")
+    assert not store.is_current(1, paths[1])
+    ingestion.pack_reports(corpus_dir)
+    assert os.path.getsize(store.data_path) == size + len("report 1, corrected")
+    assert [store.get(i) for i in range(3)] == ["report 0", "report 1, corrected", "report 2"]
+    assert list(ingestion.docs_data.corpus_destination) == [corpus_dir]*3
@@ -0,0 +1,112 @@
+import json
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from downloading import AsyncDownloader
+
+BODY = bytes(range(256))*64
+
+class Handler(BaseHTTPRequestHandler):
+    # etag of the served body, failures left per path and the headers of every request
+    etag = '"v1"'
+    failures = {}
+    requests = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        Handler.requests.append((self.path, dict(self.headers)))
+        if Handler.failures.get(self.path, 0) > 0:
+            Handler.failures[self.path] -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == Handler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == Handler.etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", Handler.etag)
+        self.send_header("Content-Length", str(len(BODY)-start))
+        self.end_headers()
+        self.wfile.write(BODY[start:])
+
+@pytest.fixture
+def server():
+    Handler.etag, Handler.failures, Handler.requests = '"v1"', {}, []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+def download(path, url, **kwargs):
+    downloader = AsyncDownloader(backoff=0, **kwargs)
+    return downloader.download([url + "/report.pdf"], [str(path)])[0]
+
+def test_download(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    result = download(path, server)
+    assert result["status"] == "downloaded"
+    assert path.read_bytes() == BODY
+    assert not (tmp_path / "report.pdf.part").exists()
+
+def test_retry_after_server_error(server, tmp_path):
+    Handler.failures["/report.pdf"] = 2
+    path = tmp_path / "report.pdf"
+    result = download(path, server, retries=3)
+    assert result["status"] == "downloaded"
+    assert result["attempts"] == 3
+    assert path.read_bytes() == BODY
+
+def test_gives_up_after_retries(server, tmp_path):
+    Handler.failures["/report.pdf"] = 5
+    result = download(tmp_path / "report.pdf", server, retries=1)
+    assert result["status"] == "failed"
+    assert result["http_status"] == 503
+    assert result["attempts"] == 2
+
+def test_resume_partial_file(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    (tmp_path / "report.pdf.part").write_bytes(BODY[:1000])
+    (tmp_path / "report.pdf.meta").write_text(json.dumps({"etag": '"v1"'}))
+    result = download(path, server)
+    assert result["status"] == "resumed"
+    assert result["bytes"] == len(BODY)-1000
+    assert path.read_bytes() == BODY
+    headers = Handler.requests[-1][1]
+    assert headers["Range"] == "bytes=1000-"
+    assert headers["If-Range"] == '"v1"'
+
+def test_resume_restarts_when_remote_changed(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    (tmp_path / "report.pdf.part").write_bytes(b"x"*1000)
+    (tmp_path / "report.pdf.meta").write_text(json.dumps({"etag": '"v0"'}))
+    result = download(path, server)
+    assert result["status"] == "downloaded"
+    assert path.read_bytes() == BODY
+
+def test_revalidate_not_modified(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    download(path, server)
+    result = download(path, server, revalidate=True)
+    assert result["status"] == "not_modified"
+    assert Handler.requests[-1][1]["If-None-Match"] == '"v1"'
+    assert path.read_bytes() == BODY
+
+def test_revalidate_changed(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    download(path, server)
+    Handler.etag = '"v2"'
+    result = download(path, server, revalidate=True)
+    assert result["status"] == "downloaded"
+
+def test_existing_file_is_skipped(server, tmp_path):
+    path = tmp_path / "report.pdf"
+    download(path, server)
+    n_requests = len(Handler.requests)
+    assert download(path, server)["status"] == "exists"
+    assert len(Handler.requests) == n_requests
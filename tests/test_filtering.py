@@ -0,0 +1,41 @@
+import os
+import pandas as pd
+import pytest
+from benchmarks import Benchmarks
+from normalization import TextNormalizer
+from processing import DataProcessing
+from filtering import UposFilter
+
+@pytest.fixture()
+def data():
+    texts = Benchmarks(n_docs=12, doc_words=400).generate_texts()
+    return pd.DataFrame({"text": [TextNormalizer().normalize(t) for t in texts]},
+        index=range(100, 112))
+
+def _tag(data, dir_name, model, batch_size):
+    processing = DataProcessing()
+    processing.data = data.copy()
+    os.makedirs(dir_name, exist_ok=True)
+    sources = processing._tag_upos(n_jobs=1, dir_name=str(dir_name) + "/", engine="arrow",
+        batch_size=batch_size, model=model)
+    return processing, sources
+
+@pytest.mark.parametrize("min_count,min_docs", [(0, 0), (3, 1), (10, 4)])
+def test_stream_filter_matches_memory(tmp_path, upos_model, data, min_count, min_docs):
+    processing, sources = _tag(data, tmp_path, upos_model, batch_size=5)
+    memory = processing._reconstruct_upos(processing._filter_upos(
+        processing._read_upos(sources), min_count, min_docs))
+    stream = UposFilter(min_count=min_count, min_docs=min_docs).run(sources)
+    assert len(stream) > 0
+    pd.testing.assert_frame_equal(stream, memory, check_index_type=False)
+
+def test_stale_shards_are_not_counted(tmp_path, upos_model, data):
+    # an earlier run with smaller batches leaves shards the later one does not overwrite
+    _tag(data, tmp_path / "upos", upos_model, batch_size=1)
+    processing, sources = _tag(data, tmp_path / "upos", upos_model, batch_size=5)
+    _, fresh = _tag(data, tmp_path / "fresh", upos_model, batch_size=5)
+    assert len(list((tmp_path / "upos").iterdir())) == len(data)
+    assert len(sources) == 3
+    pd.testing.assert_frame_equal(processing._read_upos(sources), processing._read_upos(fresh))
+    pd.testing.assert_frame_equal(UposFilter(min_count=0, min_docs=0).get_lemma_stats(sources),
+        UposFilter(min_count=0, min_docs=0).get_lemma_stats(fresh))
@@ -0,0 +1,72 @@
+import os
+import pytest
+from manifest import ArtifactManifest
+
+PARAMS = {"converter": "libreoffice", "format": "pdf"}
+
+@pytest.fixture()
+def manifest(tmp_path):
+    return ArtifactManifest(str(tmp_path / "manifest.sqlite"))
+
+def _write(path, text, mtime=None):
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return str(path)
+
+def test_unchanged_input_is_skipped(tmp_path, manifest):
+    src = _write(tmp_path / "cop.docx", "report", 1000)
+    out = _write(tmp_path / "cop.pdf", "converted", 2000)
+    assert manifest.record_file("convert", src, out, PARAMS) is manifest
+    assert manifest.lookup_file("convert", src, out, PARAMS) == out
+    # a missing output is produced again
+    os.remove(out)
+    assert manifest.lookup_file("convert", src, out, PARAMS) is None
+
+def test_changed_input_is_rerun(tmp_path, manifest):
+    src = _write(tmp_path / "cop.docx", "report", 1000)
+    out = _write(tmp_path / "cop.pdf", "converted", 2000)
+    manifest.record_file("convert", src, out, PARAMS)
+    # same path and size, only the content and the mtime differ
+    _write(src, "REPORT", 1500)
+    assert manifest.lookup_file("convert", src, out, PARAMS) is None
+    manifest.record_file("convert", src, out, PARAMS)
+    assert manifest.lookup_file("convert", src, out, PARAMS) == out
+
+def test_changed_params_are_rerun(tmp_path, manifest):
+    src = _write(tmp_path / "cop.docx", "report", 1000)
+    out = _write(tmp_path / "cop.pdf", "converted", 2000)
+    manifest.record_file("convert", src, out, PARAMS)
+    assert manifest.lookup_file("convert", src, out, dict(PARAMS, format="pdf/a")) is None
+
+def test_outputs_are_keyed_by_path(tmp_path, manifest):
+    # identical inputs at different paths own separate outputs
+    src_a = _write(tmp_path / "a.docx", "report", 1000)
+    src_b = _write(tmp_path / "b.docx", "report", 1000)
+    out_a = _write(tmp_path / "a.pdf", "converted", 2000)
+    manifest.record_file("convert", src_a, out_a, PARAMS)
+    out_b = str(tmp_path / "b.pdf")
+    assert manifest.lookup_file("convert", src_b, out_b, PARAMS) is None
+    assert manifest.lookup_file("convert", src_a, out_a, PARAMS) == out_a
+
+def test_legacy_output_is_adopted(tmp_path, manifest):
+    src = _write(tmp_path / "cop.docx", "report", 1000)
+    out = _write(tmp_path / "cop.pdf", "converted", 2000)
+    assert manifest.lookup_file("convert", src, out, PARAMS) == out
+    # adopted outputs are recorded like produced ones
+    assert manifest.lookup("convert", manifest.hash_file(src),
+        manifest._get_file_params(out, PARAMS)) == out
+
+def test_stale_legacy_output_is_not_adopted(tmp_path, manifest):
+    src = _write(tmp_path / "cop.docx", "report", 2000)
+    out = _write(tmp_path / "cop.pdf", "converted", 1000)
+    assert manifest.lookup_file("convert", src, out, PARAMS) is None
+
+def test_recorded_input_is_not_adopted(tmp_path, manifest):
+    # once the manifest knows the input, an output it did not record is not trusted
+    src = _write(tmp_path / "cop.docx", "report", 1000)
+    out = _write(tmp_path / "cop.pdf", "converted", 2000)
+    manifest.record_file("convert", src, out, PARAMS)
+    _write(src, "REPORT", 1500)
+    assert manifest.lookup_file("convert", src, out, PARAMS) is None
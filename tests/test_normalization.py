@@ -0,0 +1,37 @@
+import io
+import random
+import pytest
+from normalization import TextNormalizer, regex_normalize
+
+LINES = ["info@company.com", "Info.Team@company.org", "<b>", "</p>", "<div class='x'>",
+    "https://www.unglobalcompact.org/cop", "see http://x.org/a, then", "ftp://files.net/r.pdf",
+    "We report our our our progress.", "CO2 \\- emissions fell by 12%.", "é à •", "the the",
+    "abcabcabc", "hello hello, world world!", "", "  ", "\t", "Sustainability Report 2021"]
+
+def stream(text, chunk_size):
+    normalizer = TextNormalizer(chunk_size=chunk_size)
+    return "".join(normalizer.iter_normalize(normalizer._iter_chunks(io.StringIO(text))))
+
+@pytest.mark.parametrize("text", [
+    "info@company.com\n<b>",
+    "info@company.com\n<b></p>https://www.unglobalcompact.org/cop",
+    "info@company.com\n<b>\nhttps://www.unglobalcompact.org/cop",
+    "info@company.com\n<b>\nreport",
+    "<p>\ninfo@company.com\n",
+    "report\ninfo@company.com",
+])
+@pytest.mark.parametrize("chunk_size", [1, 5, 17, 2**20])
+def test_email_line_across_chunks(text, chunk_size):
+    assert stream(text, chunk_size) == regex_normalize(text)
+
+def test_random_documents_in_small_chunks():
+    # golden comparison with the reference on inputs forced into many chunks
+    rng = random.Random(0)
+    normalizer = TextNormalizer()
+    for _ in range(2000):
+        text = "\n".join(rng.choices(LINES, k=rng.randint(1, 8)))
+        if rng.random() < 0.5:
+            text += "\n"
+        reference = regex_normalize(text)
+        assert normalizer.normalize(text) == reference, text
+        assert stream(text, rng.randint(1, 40)) == reference, text
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+from benchmarks import Benchmarks
+from processing import DataProcessing
+from partitioning import ShardedProcessing
+
+@pytest.fixture()
+def data_file(tmp_path):
+    txt_dir = tmp_path / "txt_files"
+    txt_dir.mkdir()
+    texts = Benchmarks(n_docs=10, doc_words=400).generate_texts()
+    paths = []
+    for i, text in enumerate(texts):
+        paths.append(str(txt_dir / f"cop_{i}.txt"))
+        with open(paths[-1], "w") as f:
+            f.write(text)
+    path = str(tmp_path / "ingested.parquet")
+    pd.DataFrame({"name": [f"Company {i}" for i in range(len(texts))],
+        "txt_file_destination": paths}, index=range(200, 200+len(texts))).to_parquet(path)
+    return path
+
+@pytest.mark.parametrize("stream_filter", [False, True])
+def test_run_local_matches_single_process(tmp_path, upos_model, data_file, stream_filter):
+    upos_kwargs = {"engine": "arrow", "model": upos_model, "n_jobs": 1}
+    processing = DataProcessing(data_file, str(tmp_path) + "/").load_data()
+    processing.preprocess_reports(n_jobs=1, stream=True,
+        dir_name=str(tmp_path / "text_shards") + "/")
+    (tmp_path / "upos_files").mkdir()
+    processing.construct_upos(dir_name=str(tmp_path / "upos_files") + "/",
+        stream_filter=stream_filter, min_count=3, min_docs=2, **upos_kwargs)
+    processing.get_metadata()
+    # settings differ from the defaults, the nodes only see them through run_local
+    sharded = ShardedProcessing(n_shards=3, data_file=data_file,
+        work_dir=str(tmp_path / "partitions") + "/", preprocess_kwargs={"n_jobs": 1},
+        upos_kwargs=upos_kwargs, min_count=3, min_docs=2, stream_filter=stream_filter)
+    sharded.run_local(file_path=str(tmp_path / "processed.parquet"), n_jobs=1)
+    expected = processing.data.drop(columns="text_shard").sort_index()
+    result = pd.read_parquet(tmp_path / "processed.parquet").drop(columns="text_shard")
+    assert len(expected) > 0
+    assert set(sharded.get_shard_ids(expected.index)) == {0, 1, 2}
+    pd.testing.assert_frame_equal(result[expected.columns], expected,
+        check_index_type=False)
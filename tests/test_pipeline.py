@@ -0,0 +1,78 @@
+import threading
+import pandas as pd
+import pytest
+from ingestion import DataIngestion
+from pipeline import Pipeline
+
+N_DOCS = 7
+
+@pytest.fixture()
+def stages(monkeypatch):
+    # stub stages, every call is logged with the documents it saw
+    calls, failing, lock = [], set(), threading.Lock()
+    def load_data(self):
+        self.docs_data = pd.DataFrame({"name": [f"Company {i}" for i in range(N_DOCS)]},
+            index=range(50, 50+N_DOCS))
+        return self
+    def stage(name, column):
+        def run(self, **kwargs):
+            ids = list(self.docs_data.index)
+            with lock:
+                calls.append((name, ids))
+            if failing.intersection(ids) and name == "convert":
+                raise RuntimeError("converter crashed")
+            self.docs_data[column] = [f"{name}_{i}" for i in ids]
+            return self
+        return run
+    monkeypatch.setattr(DataIngestion, "load_data", load_data)
+    monkeypatch.setattr(DataIngestion, "download_reports", stage("download", "file"))
+    monkeypatch.setattr(DataIngestion, "convert_reports", stage("convert", "converted"))
+    return calls, failing
+
+def _get_pipeline(tmp_path, batch_size):
+    return Pipeline({"checkpoint_dir": str(tmp_path / "checkpoints") + "/",
+        "overlap": {"stages": ["download", "convert"], "batch_size": batch_size}})
+
+def _get_docs(calls, name):
+    return sorted(i for stage, ids in calls if stage == name for i in ids)
+
+def _check_result(pipeline):
+    data = pipeline.ingestion.docs_data
+    assert list(data.index) == list(range(50, 50+N_DOCS))
+    assert list(data.file) == [f"download_{i}" for i in data.index]
+    assert list(data.converted) == [f"convert_{i}" for i in data.index]
+
+@pytest.mark.parametrize("stage", ["load", "preprocess", "upos", "metadata", "handoff"])
+def test_only_ingestion_stages_overlap(tmp_path, stage):
+    with pytest.raises(ValueError):
+        Pipeline({"checkpoint_dir": str(tmp_path) + "/", "overlap": {"stages": [stage]}})
+
+def test_resume_after_crash(tmp_path, stages):
+    calls, failing = stages
+    # the last batch crashes, the batches before it are checkpointed
+    failing.add(50+N_DOCS-1)
+    with pytest.raises(RuntimeError):
+        _get_pipeline(tmp_path, 3).run(["convert"])
+    failing.clear()
+    calls.clear()
+    pipeline = _get_pipeline(tmp_path, 3).run(["convert"])
+    assert _get_docs(calls, "download") == [56]
+    assert _get_docs(calls, "convert") == [56]
+    _check_result(pipeline)
+    # a finished run is not repeated
+    calls.clear()
+    _check_result(_get_pipeline(tmp_path, 3).run(["convert"]))
+    assert calls == []
+
+def test_resume_with_other_batch_size(tmp_path, stages):
+    calls, failing = stages
+    failing.add(50+N_DOCS-1)
+    with pytest.raises(RuntimeError):
+        _get_pipeline(tmp_path, 2).run(["convert"])
+    failing.clear()
+    calls.clear()
+    # no checkpoint of the old size matches, every document is processed exactly once
+    pipeline = _get_pipeline(tmp_path, 3).run(["convert"])
+    assert _get_docs(calls, "download") == list(range(50, 50+N_DOCS))
+    assert _get_docs(calls, "convert") == list(range(50, 50+N_DOCS))
+    _check_result(pipeline)
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+import spacy
+from ingestion import DataIngestion
+from normalization import TextNormalizer
+from processing import DataProcessing
+
+TEXTS = ["<b>Our Sustainability</b> report 2021, water water and energy.",
+    "Visit https://www.unglobalcompact.org/cop for the\nfull report!",
+    "Emissions fell. Emissions fell. Employees \\- trained."]
+
+def _pack(tmp_path):
+    txt_dir = tmp_path / "txt_files"
+    txt_dir.mkdir()
+    rows = []
+    for i, text in enumerate(TEXTS):
+        path = txt_dir / f"cop_{i}.txt"
+        path.write_text(text)
+        rows.append({"name": f"Company {i}", "txt_file_destination": str(path)})
+    ingestion = DataIngestion(data_folder=str(tmp_path) + "/")
+    ingestion.docs_data = pd.DataFrame(rows, index=[10, 11, 12])
+    return ingestion.pack_reports(str(tmp_path / "corpus") + "/", remove_files=True)
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("with_txt_column", [False, True])
+def test_preprocess_packed_reports(tmp_path, stream, with_txt_column):
+    ingestion = _pack(tmp_path)
+    assert not list((tmp_path / "txt_files").iterdir())
+    data = ingestion.docs_data
+    if not with_txt_column:
+        # the joblib reader packs pdf text directly, the frame has no txt column at all
+        data = data.drop(columns="txt_file_destination")
+    processing = DataProcessing(data_folder=str(tmp_path) + "/")
+    processing.data = data
+    expected = [TextNormalizer().normalize(t) for t in TEXTS]
+    if stream:
+        processing.preprocess_reports(n_jobs=1, stream=True,
+            dir_name=str(tmp_path / "text_shards") + "/")
+        texts = pd.concat(pd.read_parquet(p) for p in processing.data.text_shard.unique())\
+            .set_index("doc_id").text
+        assert list(processing.data.text_chars) == [len(t) for t in expected]
+    else:
+        processing.preprocess_reports(n_jobs=1)
+        texts = processing.data.text
+    assert list(texts.loc[[10, 11, 12]]) == expected
+
+def _tag(tmp_path, model, manifest_file=None):
+    processing = DataProcessing(manifest_file=manifest_file)
+    processing.data = pd.DataFrame({"text": [TextNormalizer().normalize(t) for t in TEXTS]},
+        index=[10, 11, 12])
+    sources = processing._tag_upos(n_jobs=1, dir_name=str(tmp_path / "upos_files") + "/",
+        engine="arrow", batch_size=2, model=model)
+    return processing._read_upos(sources).sort_values("doc_id", kind="stable")
+
+def test_plain_tagging_ignores_incremental_shards(tmp_path, upos_model):
+    incremental = _tag(tmp_path, upos_model, str(tmp_path / "manifest.sqlite"))
+    plain = _tag(tmp_path, upos_model)
+    nlp = spacy.load(upos_model)
+    assert len(incremental) == sum(len(nlp(TextNormalizer().normalize(t))) for t in TEXTS)
+    pd.testing.assert_frame_equal(plain.reset_index(drop=True),
+        incremental.reset_index(drop=True))
@@ -0,0 +1,21 @@
+import numpy as np
+import scipy.sparse as sp
+from topics import LdaSweep
+
+def test_save_dtm_shuffles_in_blocks(tmp_path):
+    dtm = sp.csr_matrix((sp.random(503, 40, density=0.1, random_state=1)*10).astype(np.int64))
+    order = np.random.default_rng(1).permutation(dtm.shape[0])
+    sweep = LdaSweep(model_dir=str(tmp_path))
+    sweep.save_dtm(dtm, order, block_rows=37)
+    saved = sweep.load_dtm()
+    assert saved.dtype == np.float64
+    assert (saved != sp.csr_matrix(dtm, dtype=np.float64)[order]).nnz == 0
+
+def test_run_holds_out_rows(tmp_path):
+    dtm = sp.csr_matrix((sp.random(200, 30, density=0.2, random_state=2)*10).astype(np.int64))
+    sweep = LdaSweep(n_topics=(2, 3), n_jobs=1, max_iter=2, model_dir=str(tmp_path))
+    results = sweep.run(dtm, [f"w{i}" for i in range(30)])
+    assert list(results.n_topics) == [2, 3]
+    assert results.heldout.all()
+    loaded = LdaSweep(model_dir=str(tmp_path)).load_results()
+    assert list(loaded.model_path) == list(results.model_path)